@@ -0,0 +1,55 @@
+from hashlib import sha256
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.utils.translation import gettext_lazy as _
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.exceptions import AuthenticationFailed
+
+from foodgram.metrics import cache_lookup
+from foodgram.settings import AUTH_TOKEN_CACHE_TIMEOUT
+
+User = get_user_model()
+
+
+def token_cache_key(key):
+    return f'auth_token:{sha256(key.encode()).hexdigest()}'
+
+
+# Счетчики меняются запросами UPDATE без сигналов, а хэш пароля
+# незачем держать в кеше: эти поля загружаются из базы при обращении.
+UNCACHED_USER_FIELDS = ('password', *User.counter_fields)
+CACHED_USER_FIELDS = tuple(
+    field.attname for field in User._meta.concrete_fields
+    if field.name not in UNCACHED_USER_FIELDS
+)
+
+
+def forget_tokens(*keys):
+    cache.delete_many([token_cache_key(key) for key in keys])
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """TokenAuthentication, запоминающая в кеше поля владельца токена.
+
+    Запись кеша удаляется при сохранении пользователя (смена пароля,
+    прав, деактивация) и при удалении токена (выход), иначе живет
+    AUTH_TOKEN_CACHE_TIMEOUT секунд. Чтобы это действовало во всех
+    процессах, кеш должен быть общим (проверка api.E001)."""
+
+    def authenticate_credentials(self, key):
+        cache_key = token_cache_key(key)
+        values = cache.get(cache_key)
+        cache_lookup('auth_token', values is not None)
+        if values is None:
+            user, token = super().authenticate_credentials(key)
+            cache.set(
+                cache_key,
+                [getattr(user, field) for field in CACHED_USER_FIELDS],
+                AUTH_TOKEN_CACHE_TIMEOUT
+            )
+            return user, token
+        user = User.from_db('default', CACHED_USER_FIELDS, values)
+        if not user.is_active:
+            raise AuthenticationFailed(_('User inactive or deleted.'))
+        return user, self.get_model()(key=key, user=user)
@@ -0,0 +1,23 @@
+from django.conf import settings
+from django.core.checks import Error, Tags, register
+
+PROCESS_LOCAL_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+@register(Tags.caches, deploy=True)
+def check_shared_cache(app_configs, **kwargs):
+    """Кеш по умолчанию должен быть общим для всех процессов: в нем
+    токены авторизации, удаляемые при выходе, и отметки о записи,
+    после которой клиент читает с основной базы."""
+    backend = settings.CACHES['default']['BACKEND']
+    if backend in PROCESS_LOCAL_CACHES:
+        return [Error(
+            f'Кеш {backend} не общий для процессов сервера.',
+            hint='Укажите CACHE_BACKEND и CACHE_LOCATION, например '
+                 'memcached.',
+            id='api.E001',
+        )]
+    return []
@@ -1,33 +1,125 @@
 import base64
 import binascii
-import imghdr
+import re
+import tempfile
 import uuid
 
-import six
-from django.core.files.base import ContentFile
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import UploadedFile
 from rest_framework import serializers
 
+from foodgram.settings import MAX_IMAGE_SIZE
+from recipes.images import variant_paths
+
+IMAGE_SIGNATURES = (
+    (b'\xff\xd8\xff', 'jpg', 'image/jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'png', 'image/png'),
+    (b'GIF87a', 'gif', 'image/gif'),
+    (b'GIF89a', 'gif', 'image/gif'),
+    (b'BM', 'bmp', 'image/bmp'),
+)
+
+BASE64_CHUNK_SIZE = 64 * 1024
+
+WHITESPACE = re.compile(r'\s')
+
+
+def detect_image_type(header):
+    """Определяет формат изображения по первым байтам файла."""
+    if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+        return 'webp', 'image/webp'
+    for signature, extension, content_type in IMAGE_SIGNATURES:
+        if header.startswith(signature):
+            return extension, content_type
+    return None, None
+
 
 class Base64ImageField(serializers.ImageField):
+    """Изображение в base64 или файлом из multipart-запроса.
+
+    Base64 декодируется частями во временный файл, который держится
+    в памяти только до FILE_UPLOAD_MAX_MEMORY_SIZE байт."""
+
+    default_error_messages = {
+        'too_large': 'Файл больше {max_size} Мб.',
+        'corrupted': 'Ошибка загрузки изображения. Файл поврежден.',
+        'unknown_type': (
+            'Неподдерживаемый формат изображения. '
+            'Допустимы JPEG, PNG, GIF, BMP и WebP.'
+        ),
+    }
 
     def to_internal_value(self, data):
         if not data:
             return None
 
-        if isinstance(data, six.string_types):
-            if 'data:' in data and ';base64,' in data:
-                header, data = data.split(';base64,')
-            try:
-                decoded_file = base64.b64decode(data)
-            except (TypeError, binascii.Error, ValueError):
-                self.fail('Ошибка загрузки изображения. Файл поврежден.')
-            file_name = str(uuid.uuid4())[:12]
-            file_extension = self.get_file_extension(file_name, decoded_file)
-            complete_file_name = f'{file_name}.{file_extension}'
-            data = ContentFile(decoded_file, name=complete_file_name)
+        if isinstance(data, str):
+            data = self.decode(data)
+        elif getattr(data, 'size', 0) > MAX_IMAGE_SIZE:
+            self.too_large()
         return super(Base64ImageField, self).to_internal_value(data)
 
-    def get_file_extension(self, file_name, decoded_file):
-        extension = imghdr.what(file_name, decoded_file)
-        extension = 'jpg' if extension == 'jpeg' else extension
-        return extension
+    def too_large(self):
+        self.fail('too_large', max_size=MAX_IMAGE_SIZE // (1024 * 1024))
+
+    def decode(self, data):
+        if 'data:' in data and ';base64,' in data:
+            header, data = data.split(';base64,')
+        if len(data) // 4 * 3 > MAX_IMAGE_SIZE:
+            self.too_large()
+        if WHITESPACE.search(data):
+            data = WHITESPACE.sub('', data)
+        decoded_file = tempfile.SpooledTemporaryFile(
+            max_size=settings.FILE_UPLOAD_MAX_MEMORY_SIZE
+        )
+        try:
+            for start in range(0, len(data), BASE64_CHUNK_SIZE):
+                decoded_file.write(base64.b64decode(
+                    data[start:start + BASE64_CHUNK_SIZE]
+                ))
+        except (TypeError, binascii.Error, ValueError):
+            decoded_file.close()
+            self.fail('corrupted')
+        size = decoded_file.tell()
+        decoded_file.seek(0)
+        file_extension, content_type = detect_image_type(
+            decoded_file.read(32)
+        )
+        if file_extension is None:
+            decoded_file.close()
+            self.fail('unknown_type')
+        decoded_file.seek(0)
+        file_name = str(uuid.uuid4())[:12]
+        return UploadedFile(
+            decoded_file,
+            name=f'{file_name}.{file_extension}',
+            content_type=content_type,
+            size=size,
+        )
+
+
+class ImageVariantsField(serializers.Field):
+    """Ссылки на превью изображения рецепта по размерам и форматам.
+
+    Пока превью для текущего изображения не готовы, отдает None."""
+
+    def __init__(self, **kwargs):
+        kwargs['source'] = '*'
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, recipe):
+        if not recipe.image or recipe.image_variants_for != recipe.image.name:
+            return None
+        request = self.context.get('request')
+        return {
+            variant: {
+                image_format: (
+                    request.build_absolute_uri(default_storage.url(path))
+                    if request is not None else default_storage.url(path)
+                )
+                for image_format, path in paths.items()
+            }
+            for variant, paths in variant_paths(recipe.image.name).items()
+        }
@@ -1,11 +1,24 @@
+from django.contrib.postgres.search import (
+    SearchQuery, SearchRank, TrigramSimilarity
+)
+from django.db import connections
+from django.db.models import Case, F, Func, IntegerField, Q, Value, When
 from django_filters import rest_framework as filters
-from rest_framework.filters import SearchFilter
 
+from foodgram.settings import RECIPE_SEARCH_CONFIG
 from recipes.models import Recipe
 
 
-class IngredientFilter(SearchFilter):
-    search_param = 'name'
+def unicode_lower(value):
+    return value.lower() if value is not None else None
+
+
+class UnicodeLower(Func):
+    """LOWER для SQLite, понимающий не только ASCII. Функция
+    регистрируется на соединении в api.signals."""
+
+    function = 'UNICODE_LOWER'
+    arity = 1
 
 
 class RecipeFilter(filters.FilterSet):
@@ -19,6 +32,9 @@ class RecipeFilter(filters.FilterSet):
     tags = filters.AllValuesMultipleFilter(
         field_name='tags__slug'
     )
+    search = filters.CharFilter(
+        method='filter_search'
+    )
 
     class Meta:
         model = Recipe
@@ -36,3 +52,36 @@ class RecipeFilter(filters.FilterSet):
         if value and self.request.user.is_authenticated:
             return queryset.filter(shopping_cart__user=self.request.user)
         return queryset
+
+    def filter_search(self, queryset, name, value):
+        value = value.strip()
+        if not value:
+            return queryset
+        if connections[queryset.db].vendor == 'postgresql':
+            query = SearchQuery(
+                value,
+                config=RECIPE_SEARCH_CONFIG,
+                search_type='plain'
+            )
+            queryset = queryset.filter(
+                Q(search_vector=query) | Q(name__trigram_similar=value)
+            ).annotate(
+                rank=SearchRank(F('search_vector'), query),
+                similarity=TrigramSimilarity('name', value),
+            )
+            ordering = ('-rank', '-similarity')
+        else:
+            value = unicode_lower(value)
+            queryset = queryset.annotate(
+                name_lower=UnicodeLower('name'),
+                text_lower=UnicodeLower('text'),
+            ).filter(
+                Q(name_lower__contains=value) | Q(text_lower__contains=value)
+            ).annotate(rank=Case(
+                When(name_lower__startswith=value, then=Value(3)),
+                When(name_lower__contains=value, then=Value(2)),
+                default=Value(1),
+                output_field=IntegerField(),
+            ))
+            ordering = ('-rank',)
+        return queryset.order_by(*ordering, *Recipe._meta.ordering)
@@ -0,0 +1,273 @@
+import json
+import random
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from itertools import count
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from foodgram.settings import API_AUTHENTICATION
+from recipes.models import Ingredient, Recipe, Tag
+
+User = get_user_model()
+
+PAGE_SIZE = 6
+
+MAX_PAGES = 50
+
+
+def percentile(values, share):
+    """Процентиль методом ближайшего ранга по отсортированному списку."""
+    if not values:
+        return None
+    rank = max(int(len(values) * share + 0.5), 1)
+    return values[min(rank, len(values)) - 1]
+
+
+class Scenarios:
+    """Запросы к горячим эндпоинтам; каждый метод выполняет одну операцию
+    и возвращает список ответов."""
+
+    def __init__(self, recipe_ids, tag_slugs, ingredient_names, pages):
+        self.recipe_ids = recipe_ids
+        self.pages = pages
+        self.tag_slugs = tag_slugs
+        self.ingredient_names = ingredient_names
+
+    def recipes_list(self, client, rnd):
+        return [client.get(f'/api/recipes/?page={rnd.randint(1, self.pages)}')]
+
+    def recipes_filtered(self, client, rnd):
+        tags = '&'.join(
+            f'tags={slug}'
+            for slug in rnd.sample(self.tag_slugs, min(2, len(self.tag_slugs)))
+        )
+        return [client.get(f'/api/recipes/?{tags}&is_favorited=0&limit=6')]
+
+    def recipes_cursor(self, client, rnd):
+        return [client.get('/api/recipes/?cursor=&limit=6')]
+
+    def recipe_detail(self, client, rnd):
+        return [client.get(f'/api/recipes/{rnd.choice(self.recipe_ids)}/')]
+
+    def subscriptions(self, client, rnd):
+        return [client.get('/api/users/subscriptions/?recipes_limit=3')]
+
+    def feed(self, client, rnd):
+        return [client.get('/api/recipes/feed/?limit=6')]
+
+    def ingredient_search(self, client, rnd):
+        name = rnd.choice(self.ingredient_names)
+        prefix = name[:rnd.randint(1, min(4, len(name)))]
+        return [client.get('/api/ingredients/', {'name': prefix})]
+
+    def download_shopping_cart(self, client, rnd):
+        return [client.get('/api/recipes/download_shopping_cart/')]
+
+    def _toggle(self, client, rnd, path):
+        url = f'/api/recipes/{rnd.choice(self.recipe_ids)}/{path}/'
+        first = client.post(url)
+        if first.status_code == 400:
+            return [client.delete(url), client.post(url)]
+        return [first, client.delete(url)]
+
+    def favorite_toggle(self, client, rnd):
+        return self._toggle(client, rnd, 'favorite')
+
+    def shopping_cart_toggle(self, client, rnd):
+        return self._toggle(client, rnd, 'shopping_cart')
+
+
+SCENARIOS = (
+    'recipes_list', 'recipes_filtered', 'recipes_cursor', 'recipe_detail',
+    'subscriptions', 'feed', 'ingredient_search', 'download_shopping_cart',
+    'favorite_toggle', 'shopping_cart_toggle',
+)
+
+
+class Command(BaseCommand):
+    help = 'Benchmark hot API endpoints and print latency report as JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--requests',
+            type=int,
+            default=200,
+            help='operations per scenario',
+        )
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=4,
+            help='parallel client threads',
+        )
+        parser.add_argument(
+            '--warmup',
+            type=int,
+            default=10,
+            help='unmeasured operations per scenario',
+        )
+        parser.add_argument(
+            '--scenario',
+            action='append',
+            choices=SCENARIOS,
+            help='run only the given scenario, may be repeated',
+        )
+        parser.add_argument(
+            '--user',
+            help='email of the user to benchmark as',
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=0,
+        )
+        parser.add_argument(
+            '--output',
+            help='write the JSON report to a file instead of stdout',
+        )
+
+    def get_user(self, email):
+        users = User.objects.filter(is_active=True)
+        if email:
+            users = users.filter(email=email)
+        else:
+            users = users.order_by('-following_count', 'id')
+        user = users.first()
+        if user is None:
+            raise CommandError('Нет пользователя для запуска бенчмарка.')
+        return user
+
+    def get_authorization(self):
+        """Заголовок Authorization настоящего токена пользователя, чтобы
+        запросы проходили аутентификацию так же, как обычный трафик."""
+        if API_AUTHENTICATION == 'jwt':
+            return f'Bearer {AccessToken.for_user(self.user)}'
+        token, _ = Token.objects.get_or_create(user=self.user)
+        return f'Token {token.key}'
+
+    def client(self):
+        client = getattr(self.local, 'client', None)
+        if client is None:
+            client = self.local.client = APIClient(HTTP_HOST=self.host)
+            client.credentials(HTTP_AUTHORIZATION=self.authorization)
+        return client
+
+    def operation(self, method, seed):
+        """Время, число запросов к базе, ответов и ошибок операции.
+        Исключение не прерывает бенчмарк, а попадает в отчет."""
+        rnd = random.Random(seed)
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            try:
+                responses = method(self.client(), rnd)
+                for response in responses:
+                    if response.streaming:
+                        for _ in response.streaming_content:
+                            pass
+            except Exception as error:
+                return None, len(queries), 0, 1, (
+                    f'{type(error).__name__}: {error}'
+                )
+            elapsed = time.perf_counter() - started
+        errors = sum(response.status_code >= 400 for response in responses)
+        return elapsed, len(queries), len(responses), errors, None
+
+    def run(self, method, options):
+        seeds = count(options['seed'] * 1_000_000)
+        with ThreadPoolExecutor(options['concurrency']) as executor:
+            list(executor.map(
+                lambda seed: self.operation(method, seed),
+                (next(seeds) for _ in range(options['warmup']))
+            ))
+            started = time.perf_counter()
+            results = list(executor.map(
+                lambda seed: self.operation(method, seed),
+                (next(seeds) for _ in range(options['requests']))
+            ))
+            duration = time.perf_counter() - started
+        completed = [result for result in results if result[4] is None]
+        latencies = sorted(result[0] * 1000 for result in completed)
+        queries = [result[1] / result[2] for result in completed]
+        requests = sum(result[2] for result in results)
+        report = {
+            'operations': len(results),
+            'requests': requests,
+            'errors': sum(result[3] for result in results),
+            'exceptions': dict(Counter(
+                result[4] for result in results if result[4] is not None
+            )),
+            'throughput_rps': round(requests / duration, 2),
+            'latency_ms': None,
+            'queries_per_request': None,
+        }
+        if completed:
+            report['latency_ms'] = {
+                'p50': round(percentile(latencies, 0.50), 2),
+                'p95': round(percentile(latencies, 0.95), 2),
+                'p99': round(percentile(latencies, 0.99), 2),
+                'mean': round(sum(latencies) / len(latencies), 2),
+                'max': round(latencies[-1], 2),
+            }
+            report['queries_per_request'] = {
+                'mean': round(sum(queries) / len(queries), 2),
+                'max': max(queries),
+            }
+        return report
+
+    def handle(self, *args, **options):
+        if options['requests'] < 1 or options['concurrency'] < 1:
+            raise CommandError('Нужен хотя бы один запрос и один поток.')
+        recipe_ids = list(
+            Recipe.objects.values_list('id', flat=True)[:1000]
+        )
+        tag_slugs = list(Tag.objects.values_list('slug', flat=True))
+        ingredient_names = list(
+            Ingredient.objects.values_list('name', flat=True)[:1000]
+        )
+        if not recipe_ids or not tag_slugs or not ingredient_names:
+            raise CommandError(
+                'База пуста: заполните ее командой generate_dataset.'
+            )
+        self.user = self.get_user(options['user'])
+        self.authorization = self.get_authorization()
+        self.host = next(
+            (
+                host for host in settings.ALLOWED_HOSTS
+                if host != '*' and not host.startswith('.')
+            ),
+            'testserver'
+        )
+        self.local = threading.local()
+        scenarios = Scenarios(
+            recipe_ids, tag_slugs, ingredient_names,
+            pages=min(-(-Recipe.objects.count() // PAGE_SIZE), MAX_PAGES)
+        )
+        report = {
+            'database': connection.vendor,
+            'user': self.user.email,
+            'requests': options['requests'],
+            'concurrency': options['concurrency'],
+            'seed': options['seed'],
+            'scenarios': {},
+        }
+        for name in options['scenario'] or SCENARIOS:
+            self.stderr.write(f'Running {name}...')
+            report['scenarios'][name] = self.run(
+                getattr(scenarios, name), options
+            )
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                f.write(output)
+        else:
+            self.stdout.write(output)
@@ -1,6 +1,198 @@
-from rest_framework.pagination import PageNumberPagination
+import binascii
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import date
+from functools import reduce
+from operator import or_
+
+from django.core.exceptions import ValidationError
+from django.db.models import DateTimeField, IntegerField, Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+from foodgram.settings import MAX_PAGE_SIZE
+
+BIGINT_LIMIT = 2 ** 63
+
+
+class KeysetPagination(BasePagination):
+    """Курсорная пагинация по полному кортежу сортировки queryset.
+
+    Курсор хранит значения полей сортировки последнего объекта или
+    строки values() на странице, следующая страница выбирается условием
+    по этим значениям без OFFSET и COUNT(*). Первичный ключ дописывается
+    к сортировке, чтобы порядок был строгим. Значения из курсора
+    приводятся полями сортировки, курсор, который не удалось привести,
+    дает 404."""
+
+    cursor_query_param = 'cursor'
+    page_size = 6
+    page_size_query_param = 'limit'
+    max_page_size = MAX_PAGE_SIZE
+    invalid_cursor_message = 'Неверный курсор.'
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if size <= 0:
+            return self.page_size
+        return min(size, self.max_page_size)
+
+    def get_ordering(self, queryset):
+        model = queryset.model
+        ordering = []
+        for name in queryset.query.order_by or model._meta.ordering:
+            descending = name.startswith('-')
+            name = name.lstrip('-')
+            if name == 'pk':
+                name = model._meta.pk.name
+            if name not in queryset.query.annotations:
+                name = model._meta.get_field(name).attname
+            ordering.append((name, descending))
+        if model._meta.pk.attname not in dict(ordering):
+            ordering.append((model._meta.pk.attname, True))
+        return ordering
+
+    def get_ordering_fields(self, queryset):
+        annotations = queryset.query.annotations
+        return [
+            annotations[name].output_field if name in annotations
+            else queryset.model._meta.get_field(name)
+            for name, _ in self.ordering
+        ]
+
+    def to_python(self, values):
+        converted = []
+        for value, field in zip(values, self.ordering_fields):
+            if value is None:
+                raise NotFound(self.invalid_cursor_message)
+            try:
+                value = field.to_python(value)
+                field.run_validators(value)
+                value = field.get_prep_value(value)
+                if isinstance(value, int) and not (
+                    -BIGINT_LIMIT <= value < BIGINT_LIMIT
+                ):
+                    raise ValueError('Целое вне диапазона bigint.')
+            except (TypeError, ValueError, ValidationError):
+                raise NotFound(self.invalid_cursor_message)
+            converted.append(value)
+        return converted
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            values = json.loads(urlsafe_b64decode(encoded.encode()))
+        except (TypeError, ValueError, binascii.Error):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(values, list) or len(values) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return self.to_python(values)
+
+    @staticmethod
+    def encode_value(value):
+        if isinstance(value, date):
+            return value.isoformat()
+        raise TypeError(f'{type(value).__name__} не поддерживается курсором')
+
+    def encode_cursor(self, obj):
+        if isinstance(obj, dict):
+            values = [obj[name] for name, _ in self.ordering]
+        else:
+            values = [getattr(obj, name) for name, _ in self.ordering]
+        return urlsafe_b64encode(
+            json.dumps(values, default=self.encode_value).encode()
+        ).decode()
+
+    def after(self, values):
+        conditions = []
+        for position, (name, descending) in enumerate(self.ordering):
+            lookup = {
+                f'{previous}__exact': value
+                for (previous, _), value in zip(
+                    self.ordering[:position], values
+                )
+            }
+            lookup[f'{name}__{"lt" if descending else "gt"}'] = (
+                values[position]
+            )
+            conditions.append(Q(**lookup))
+        return reduce(or_, conditions)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.ordering = self.get_ordering(queryset)
+        self.ordering_fields = self.get_ordering_fields(queryset)
+        queryset = queryset.order_by(*(
+            f'-{name}' if descending else name
+            for name, descending in self.ordering
+        ))
+        values = self.decode_cursor(request)
+        if values is not None:
+            queryset = queryset.filter(self.after(values))
+        page = list(queryset[:self.page_size + 1])
+        self.has_next = len(page) > self.page_size
+        self.page = page[:self.page_size]
+        return self.page
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        return replace_query_param(
+            self.request.build_absolute_uri(),
+            self.cursor_query_param,
+            self.encode_cursor(self.page[-1])
+        )
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'results': data,
+        })
+
+
+class FeedPagination(KeysetPagination):
+    """Курсорная пагинация ленты по дате публикации и id рецепта.
+
+    Вместо queryset принимает функцию, которая по курсору и числу строк
+    возвращает следующие строки ленты."""
+
+    ordering = (('pub_date', True), ('id', True))
+    ordering_fields = (DateTimeField(), IntegerField())
+
+    def paginate_queryset(self, rows, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        page = rows(self.decode_cursor(request), self.page_size + 1)
+        self.has_next = len(page) > self.page_size
+        self.page = page[:self.page_size]
+        return self.page
 
 
 class LimitPageNumberPagination(PageNumberPagination):
+    """Постраничная пагинация; параметр cursor включает курсорную."""
+
     page_size = 6
     page_size_query_param = 'limit'
+    max_page_size = MAX_PAGE_SIZE
+    cursor_pagination_class = KeysetPagination
+    cursor = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        query_param = self.cursor_pagination_class.cursor_query_param
+        if query_param not in request.query_params:
+            return super().paginate_queryset(queryset, request, view)
+        self.cursor = self.cursor_pagination_class()
+        return self.cursor.paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.cursor is not None:
+            return self.cursor.get_paginated_response(data)
+        return super().get_paginated_response(data)
@@ -0,0 +1,34 @@
+from rest_framework import status
+from rest_framework.exceptions import APIException
+from rest_framework.parsers import JSONParser, MultiPartParser
+
+from foodgram.settings import MAX_UPLOAD_SIZE
+
+
+class PayloadTooLarge(APIException):
+    status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    default_detail = 'Слишком большой запрос.'
+    default_code = 'payload_too_large'
+
+
+class ContentLengthLimitMixin:
+    """Отклоняет запрос по Content-Length еще до чтения тела."""
+    max_content_length = MAX_UPLOAD_SIZE
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        request = parser_context['request']
+        try:
+            content_length = int(request.META.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            content_length = 0
+        if content_length > self.max_content_length:
+            raise PayloadTooLarge()
+        return super().parse(stream, media_type, parser_context)
+
+
+class BoundedJSONParser(ContentLengthLimitMixin, JSONParser):
+    pass
+
+
+class BoundedMultiPartParser(ContentLengthLimitMixin, MultiPartParser):
+    pass
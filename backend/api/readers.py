@@ -0,0 +1,174 @@
+"""Быстрое чтение для горячих списков.
+
+Функции строят те же словари, что и сериализаторы рецептов
+и подписок, прямо из строк values() и курсора, не создавая объектов
+моделей и вложенных сериализаторов. Адреса изображений относительные,
+как у сериализаторов без запроса в контексте."""
+from collections import defaultdict
+
+from django.core.files.storage import default_storage
+from django.db import connections
+
+from recipes.images import variant_paths
+from recipes.models import IngredientRecipe, Recipe
+from users.models import User
+
+AUTHOR_FIELDS = ('id', 'email', 'username', 'first_name', 'last_name')
+
+TAG_FIELDS = ('id', 'name', 'color', 'slug')
+
+SHORT_RECIPE_COLUMNS = (
+    'id', 'author_id', 'name', 'image', 'image_variants_for',
+    'image_placeholder', 'cooking_time'
+)
+
+RANKED_RECIPES_SQL = (
+    'SELECT {columns} FROM ('
+    'SELECT *, ROW_NUMBER() OVER ('
+    'PARTITION BY author_id ORDER BY pub_date DESC, name'
+    ') AS position FROM {recipe} WHERE author_id IN ({authors})'
+    ') AS ranked WHERE position <= %s ORDER BY author_id, position'
+)
+
+
+def image_url(name):
+    return default_storage.url(name) if name else None
+
+
+def image_variants(name, variants_for):
+    """То же, что ImageVariantsField без запроса в контексте."""
+    if not name or variants_for != name:
+        return None
+    return {
+        variant: {
+            image_format: default_storage.url(path)
+            for image_format, path in paths.items()
+        }
+        for variant, paths in variant_paths(name).items()
+    }
+
+
+def _recipe_tags(recipe_ids):
+    tags = defaultdict(list)
+    rows = Recipe.tags.through.objects.filter(
+        recipe_id__in=recipe_ids
+    ).order_by('tag__slug').values_list(
+        'recipe_id', *(f'tag__{field}' for field in TAG_FIELDS)
+    )
+    for recipe_id, *values in rows:
+        tags[recipe_id].append(dict(zip(TAG_FIELDS, values)))
+    return tags
+
+
+def _recipe_ingredients(recipe_ids):
+    ingredients = defaultdict(list)
+    rows = IngredientRecipe.objects.filter(
+        recipe_id__in=recipe_ids
+    ).order_by('id').values_list(
+        'recipe_id', 'ingredient_id', 'ingredient__name',
+        'ingredient__measurement_unit', 'amount'
+    )
+    for recipe_id, ingredient_id, name, unit, amount in rows:
+        if ingredient_id is None:
+            ingredients[recipe_id].append({'amount': amount})
+            continue
+        ingredients[recipe_id].append({
+            'id': ingredient_id,
+            'name': name,
+            'measurement_unit': unit,
+            'amount': amount,
+        })
+    return ingredients
+
+
+def recipe_fragments(recipe_ids):
+    """Общая для всех зрителей часть рецептов по id.
+
+    Поля в порядке RecipeSerializer без is_favorited,
+    is_in_shopping_cart и author.is_subscribed."""
+    recipes = list(Recipe.objects.filter(id__in=recipe_ids).values(
+        'id', 'author_id', 'name', 'image', 'image_variants_for',
+        'image_placeholder', 'text', 'cooking_time'
+    ))
+    authors = {
+        author['id']: author
+        for author in User.objects.filter(
+            id__in={recipe['author_id'] for recipe in recipes}
+        ).values(*AUTHOR_FIELDS)
+    }
+    tags = _recipe_tags(recipe_ids)
+    ingredients = _recipe_ingredients(recipe_ids)
+    return {
+        recipe['id']: {
+            'id': recipe['id'],
+            'tags': tags[recipe['id']],
+            'author': authors[recipe['author_id']],
+            'ingredients': ingredients[recipe['id']],
+            'name': recipe['name'],
+            'image': image_url(recipe['image']),
+            'image_variants': image_variants(
+                recipe['image'], recipe['image_variants_for']
+            ),
+            'image_placeholder': recipe['image_placeholder'],
+            'text': recipe['text'],
+            'cooking_time': recipe['cooking_time'],
+        }
+        for recipe in recipes
+    }
+
+
+def short_recipe(row):
+    """То же, что FavoriteOrFollowSerializer без запроса в контексте."""
+    return {
+        'id': row['id'],
+        'name': row['name'],
+        'image': image_url(row['image']),
+        'image_variants': image_variants(
+            row['image'], row['image_variants_for']
+        ),
+        'image_placeholder': row['image_placeholder'],
+        'cooking_time': row['cooking_time'],
+    }
+
+
+def latest_recipes(author_ids, limit=None):
+    """Последние рецепты авторов, не больше limit на автора."""
+    if not author_ids:
+        return {}
+    if limit:
+        connection = connections[Recipe.objects.db]
+        with connection.cursor() as cursor:
+            cursor.execute(
+                RANKED_RECIPES_SQL.format(
+                    columns=', '.join(SHORT_RECIPE_COLUMNS),
+                    recipe=Recipe._meta.db_table,
+                    authors=', '.join(['%s'] * len(author_ids)),
+                ),
+                list(author_ids) + [limit]
+            )
+            rows = [
+                dict(zip(SHORT_RECIPE_COLUMNS, row))
+                for row in cursor.fetchall()
+            ]
+    else:
+        rows = Recipe.objects.filter(author_id__in=author_ids).values(
+            *SHORT_RECIPE_COLUMNS
+        )
+    recipes = defaultdict(list)
+    for row in rows:
+        recipes[row['author_id']].append(short_recipe(row))
+    return recipes
+
+
+def subscriptions(authors, limit=None):
+    """Авторы в порядке SubscriptionSerializer из строк values()."""
+    recipes = latest_recipes([author['id'] for author in authors], limit)
+    return [
+        {
+            **{field: author[field] for field in AUTHOR_FIELDS},
+            'is_subscribed': True,
+            'recipes': recipes.get(author['id'], []),
+            'recipes_count': author['recipes_count'],
+        }
+        for author in authors
+    ]
@@ -0,0 +1,85 @@
+import csv
+import json
+import os
+
+from rest_framework.exceptions import NotAcceptable
+from rest_framework.negotiation import DefaultContentNegotiation
+from rest_framework.renderers import BaseRenderer
+
+from foodgram.settings import SHOPPING_LIST_FILE_NAME, SHOPPING_LIST_FORMAT
+
+
+class ShoppingListRenderer(BaseRenderer):
+    """Выгрузка списка покупок текстом, по строке SHOPPING_LIST_FORMAT
+    на ингредиент; остальные форматы переопределяют stream().
+
+    Сам список отдается потоком через stream(), render() нужен только
+    для ответов с ошибками."""
+    media_type = 'text/plain'
+    format = 'txt'
+    charset = 'utf-8'
+    fields = ('name', 'measurement_unit', 'amount')
+
+    @property
+    def file_name(self):
+        return '{0}.{1}'.format(
+            os.path.splitext(SHOPPING_LIST_FILE_NAME)[0],
+            self.format
+        )
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return json.dumps(data, ensure_ascii=False).encode(self.charset)
+
+    def stream(self, items):
+        separator = ''
+        for item in items:
+            yield separator + SHOPPING_LIST_FORMAT.format(
+                item['name'],
+                item['measurement_unit'],
+                item['amount']
+            )
+            separator = '\n'
+
+
+class CSVShoppingListRenderer(ShoppingListRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+    class Line:
+        def write(self, value):
+            return value
+
+    def stream(self, items):
+        writer = csv.writer(self.Line())
+        yield writer.writerow(self.fields)
+        for item in items:
+            yield writer.writerow([item[field] for field in self.fields])
+
+
+class JSONLinesShoppingListRenderer(ShoppingListRenderer):
+    media_type = 'application/x-ndjson'
+    format = 'jsonl'
+
+    def stream(self, items):
+        for item in items:
+            yield json.dumps(
+                {field: item[field] for field in self.fields},
+                ensure_ascii=False
+            ) + '\n'
+
+
+SHOPPING_LIST_RENDERERS = (
+    ShoppingListRenderer,
+    CSVShoppingListRenderer,
+    JSONLinesShoppingListRenderer,
+)
+
+
+class FallbackContentNegotiation(DefaultContentNegotiation):
+    """Если Accept не подошел ни к одному формату, берет первый."""
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        try:
+            return super().select_renderer(request, renderers, format_suffix)
+        except NotAcceptable:
+            return renderers[0], renderers[0].media_type
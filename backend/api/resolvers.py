@@ -0,0 +1,44 @@
+from users.models import Follow
+
+
+class SubscriptionResolver:
+    """Подписки пользователя в рамках одного запроса.
+
+    Id авторов загружаются одним запросом при первом обращении
+    и переиспользуются всеми сериализаторами этого запроса."""
+
+    request_attribute = '_subscription_resolver'
+
+    def __init__(self, user):
+        self.user = user
+        self._authors = None
+
+    @classmethod
+    def for_request(cls, request):
+        resolver = getattr(request, cls.request_attribute, None)
+        if resolver is None or resolver.user != request.user:
+            resolver = cls(request.user)
+            setattr(request, cls.request_attribute, resolver)
+        return resolver
+
+    @property
+    def authors(self):
+        if self._authors is None:
+            if self.user.is_anonymous:
+                self._authors = set()
+            else:
+                self._authors = set(Follow.objects.filter(
+                    user=self.user
+                ).values_list('author_id', flat=True))
+        return self._authors
+
+    def is_subscribed(self, author):
+        return author.id in self.authors
+
+    def subscribe(self, author):
+        if self._authors is not None:
+            self._authors.add(author.id)
+
+    def unsubscribe(self, author):
+        if self._authors is not None:
+            self._authors.discard(author.id)
@@ -1,16 +1,36 @@
+import json
+
 from django.contrib.auth import get_user_model
+from django.db import transaction
 from djoser.serializers import UserSerializer as DjoserUserSerializer
 from rest_framework import serializers
 from rest_framework.generics import get_object_or_404
 from rest_framework.validators import UniqueTogetherValidator
 
-from api.fields import Base64ImageField
-from foodgram.settings import MAX_COOKING_TIME
+from api import readers
+from api.fields import Base64ImageField, ImageVariantsField
+from api.resolvers import SubscriptionResolver
+from foodgram.metrics import cache_lookup
+from foodgram.settings import (
+    MAX_COOKING_TIME, MAX_INGREDIENT_AMOUNT, MAX_PAGE_SIZE
+)
+from recipes import fragments, shopping_list
 from recipes.models import Ingredient, IngredientRecipe, Recipe, Tag
 from users.models import Follow
 
 User = get_user_model()
 
+PERSONAL_FIELDS = ('is_favorited', 'is_in_shopping_cart')
+
+
+def get_recipes_limit(request):
+    """Достает из запроса лимит рецептов на автора в подписках."""
+    try:
+        limit = int(request.query_params.get('recipes_limit'))
+    except (TypeError, ValueError):
+        return None
+    return limit if limit > 0 else None
+
 
 class UserSerializer(DjoserUserSerializer):
     is_subscribed = serializers.SerializerMethodField()
@@ -23,10 +43,12 @@ class UserSerializer(DjoserUserSerializer):
         )
 
     def get_is_subscribed(self, obj):
-        user = self.context.get('request').user
-        if user.is_anonymous:
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
+        request = self.context.get('request')
+        if request is None:
             return False
-        return Follow.objects.filter(user=user, author=obj.id).exists()
+        return SubscriptionResolver.for_request(request).is_subscribed(obj)
 
 
 class TagSerializer(serializers.ModelSerializer):
@@ -61,10 +83,79 @@ class IngredientRecipeSerializer(serializers.ModelSerializer):
         ]
 
 
+class RecipeListSerializer(serializers.ListSerializer):
+    """Рецепты из объектов или строк values(): общая часть берется
+    из recipes.fragments, поля зрителя добавляются к каждому ответу."""
+
+    def to_representation(self, data):
+        recipes = [
+            item if isinstance(item, dict) else {
+                'id': item.id,
+                'author_id': item.author_id,
+                'updated_at': item.updated_at,
+                'author_updated_at': getattr(
+                    item, 'author_updated_at', None
+                ) or item.author.updated_at,
+                'is_favorited': self.child.get_is_favorited(item),
+                'is_in_shopping_cart': (
+                    self.child.get_is_in_shopping_cart(item)
+                ),
+            }
+            for item in (data.all() if hasattr(data, 'all') else data)
+        ]
+        keys = fragments.fragment_keys({
+            recipe['id']: (recipe['updated_at'], recipe['author_updated_at'])
+            for recipe in recipes
+        })
+        shared = fragments.get_many(keys)
+        for recipe in recipes:
+            cache_lookup('recipe_fragment', recipe['id'] in shared)
+        missing = [
+            recipe['id'] for recipe in recipes if recipe['id'] not in shared
+        ]
+        if missing:
+            built = readers.recipe_fragments(missing)
+            fragments.set_many(keys, built)
+            shared.update(built)
+        return [
+            self.personalize(recipe, shared[recipe['id']])
+            for recipe in recipes if recipe['id'] in shared
+        ]
+
+    def personalize(self, recipe, fragment):
+        request = self.context.get('request')
+        subscriptions = (
+            SubscriptionResolver.for_request(request).authors
+            if request is not None else ()
+        )
+        data = {
+            field: recipe[field] if field in PERSONAL_FIELDS
+            else fragment[field]
+            for field in self.child.Meta.fields
+        }
+        data['author'] = {
+            **fragment['author'],
+            'is_subscribed': recipe['author_id'] in subscriptions,
+        }
+        if request is not None:
+            if data['image']:
+                data['image'] = request.build_absolute_uri(data['image'])
+            if data['image_variants']:
+                data['image_variants'] = {
+                    variant: {
+                        image_format: request.build_absolute_uri(url)
+                        for image_format, url in urls.items()
+                    }
+                    for variant, urls in data['image_variants'].items()
+                }
+        return data
+
+
 class RecipeSerializer(serializers.ModelSerializer):
     ingredients = serializers.SerializerMethodField()
     tags = TagSerializer(read_only=True, many=True)
     image = Base64ImageField()
+    image_variants = ImageVariantsField()
     author = UserSerializer(read_only=True)
     cooking_time = serializers.IntegerField()
     is_favorited = serializers.SerializerMethodField()
@@ -74,8 +165,29 @@ class RecipeSerializer(serializers.ModelSerializer):
         model = Recipe
         fields = (
             'id', 'tags', 'author', 'ingredients', 'is_favorited',
-            'is_in_shopping_cart', 'name', 'image', 'text', 'cooking_time'
+            'is_in_shopping_cart', 'name', 'image', 'image_variants',
+            'image_placeholder', 'text', 'cooking_time'
         )
+        read_only_fields = ('image_placeholder',)
+        list_serializer_class = RecipeListSerializer
+
+    def _multipart_to_dict(self, data):
+        """Приводит multipart-форму к виду JSON-запроса: ингредиенты
+        передаются строкой JSON, ярлыки — строкой JSON или полями."""
+        result = data.dict()
+        tags = data.getlist('tags')
+        try:
+            result['ingredients'] = json.loads(data.get('ingredients', '[]'))
+            if len(tags) == 1 and tags[0].lstrip().startswith('['):
+                tags = json.loads(tags[0])
+        except ValueError:
+            raise serializers.ValidationError({
+                'errors': 'Ингредиенты и ярлыки передаются списком JSON.'
+            })
+        result['tags'] = [
+            int(tag) if str(tag).isdigit() else tag for tag in tags
+        ]
+        return result
 
     def _create_ingredients(self, recipe, ingredients):
         IngredientRecipe.objects.bulk_create([
@@ -86,57 +198,156 @@ class RecipeSerializer(serializers.ModelSerializer):
             ) for ingredient in ingredients
         ])
 
+    def _update_ingredients(self, recipe, ingredients):
+        """Приводит ингредиенты рецепта к переданным, меняя только
+        отличающиеся строки. Возвращает True, если что-то изменилось."""
+        amounts = {
+            int(ingredient['id']): int(ingredient['amount'])
+            for ingredient in ingredients
+        }
+        stale, changed = [], []
+        for row in IngredientRecipe.objects.filter(recipe=recipe):
+            amount = amounts.pop(row.ingredient_id, None)
+            if amount is None:
+                stale.append(row.id)
+            elif amount != row.amount:
+                row.amount = amount
+                changed.append(row)
+        if stale:
+            IngredientRecipe.objects.filter(id__in=stale).delete()
+        if changed:
+            IngredientRecipe.objects.bulk_update(changed, ('amount',))
+        if amounts:
+            self._create_ingredients(recipe, (
+                {'id': ingredient_id, 'amount': amount}
+                for ingredient_id, amount in amounts.items()
+            ))
+        return bool(stale or changed or amounts)
+
     def to_internal_value(self, data):
-        ingredients = data.pop('ingredients')
-        tags = data.pop('tags')
+        if hasattr(data, 'getlist'):
+            data = self._multipart_to_dict(data)
+        else:
+            data = dict(data)
+        ingredients = data.pop('ingredients', None)
+        tags = data.pop('tags', None)
         data = super().to_internal_value(data)
         data['tags'] = tags
         data['ingredients'] = ingredients
         return data
 
-    def validate(self, data):
-        ingredients = data.get('ingredients')
-        errors = []
-        if not ingredients:
-            errors.append('Нужен хоть один ингредиент для рецепта')
-        ingredients_set = []
-        for ingredient in ingredients:
-            if int(ingredient['amount']) <= 0:
-                errors.append(
-                    'Количество ингредиента с id {0} должно '
-                    'быть целым и больше 0.'.format(ingredient["id"])
-                )
-            if ingredient['id'] in ingredients_set:
-                errors.append(
+    @staticmethod
+    def _to_id(value):
+        if isinstance(value, bool):
+            return None
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            return None
+
+    def _validate_ingredients(self, ingredients):
+        """Проверяет ингредиенты одним запросом к базе.
+
+        Ошибки возвращаются списком словарей по позициям ингредиентов,
+        пустой словарь означает, что позиция верна."""
+        if not isinstance(ingredients, list) or not ingredients:
+            return None, ['Нужен хоть один ингредиент для рецепта']
+        errors = [{} for _ in ingredients]
+        cleaned = []
+        seen = set()
+        for item, item_errors in zip(ingredients, errors):
+            if not isinstance(item, dict):
+                item_errors['non_field_errors'] = [
+                    'Ожидается объект с полями id и amount.'
+                ]
+                cleaned.append({'id': None})
+                continue
+            ingredient_id = self._to_id(item.get('id'))
+            amount = self._to_id(item.get('amount'))
+            if ingredient_id is None:
+                item_errors['id'] = ['Нужен целочисленный id ингредиента.']
+            elif ingredient_id in seen:
+                item_errors['id'] = [
                     'Дважды ингредиента с id {0} в рецепт положить нельзя. '
                     'Может быть стоит изменить его количество?'.format(
-                        ingredient["id"]
+                        ingredient_id
+                    )
+                ]
+            seen.add(ingredient_id)
+            if amount is None or not 0 < amount <= MAX_INGREDIENT_AMOUNT:
+                item_errors['amount'] = [
+                    'Количество ингредиента должно быть целым, больше 0 '
+                    'и не больше {0}.'.format(MAX_INGREDIENT_AMOUNT)
+                ]
+            cleaned.append({'id': ingredient_id, 'amount': amount})
+        existing = set(Ingredient.objects.filter(
+            id__in=seen - {None}
+        ).values_list('id', flat=True))
+        for item, item_errors in zip(cleaned, errors):
+            ingredient_id = item['id']
+            if ingredient_id is not None and ingredient_id not in existing:
+                item_errors.setdefault('id', []).append(
+                    'Ингредиента с id {0} не существует.'.format(
+                        ingredient_id
                     )
                 )
-            ingredients_set.append(ingredient['id'])
-        tags = data.get('tags')
-        if len(tags) > len(set(tags)):
-            errors.append('Дважды один и тот же ярлык повторять нельзя.')
-        cooking_time = float(data.get('cooking_time'))
-        if cooking_time < 1 or cooking_time > MAX_COOKING_TIME:
-            errors.append(
+        if any(errors):
+            return None, errors
+        return cleaned, None
+
+    def _validate_tags(self, tags):
+        if not isinstance(tags, list):
+            return None, ['Ярлыки передаются списком id.']
+        ids = [self._to_id(tag) for tag in tags]
+        existing = set(Tag.objects.filter(
+            id__in=set(ids) - {None}
+        ).values_list('id', flat=True))
+        errors = []
+        seen = set()
+        for tag_id in ids:
+            if tag_id is None:
+                errors.append(['Нужен целочисленный id ярлыка.'])
+            elif tag_id in seen:
+                errors.append(['Дважды один и тот же ярлык повторять нельзя.'])
+            elif tag_id not in existing:
+                errors.append(
+                    ['Ярлыка с id {0} не существует.'.format(tag_id)]
+                )
+            else:
+                errors.append([])
+            seen.add(tag_id)
+        if any(errors):
+            return None, errors
+        return ids, None
+
+    def validate(self, data):
+        errors = {}
+        data['ingredients'], errors['ingredients'] = (
+            self._validate_ingredients(data.get('ingredients'))
+        )
+        data['tags'], errors['tags'] = self._validate_tags(data.get('tags'))
+        cooking_time = data.get('cooking_time')
+        if cooking_time is not None and not (
+            1 <= cooking_time <= MAX_COOKING_TIME
+        ):
+            errors['cooking_time'] = [
                 'Время приготовления должно быть больше 1 минуты и '
                 'меньше {0} часов.'.format(MAX_COOKING_TIME / 60)
-            )
+            ]
+        errors = {field: error for field, error in errors.items() if error}
         if errors:
-            raise serializers.ValidationError({'errors': errors})
-        data['ingredients'] = ingredients
-        data['tags'] = tags
-        data['cooking_time'] = cooking_time
+            raise serializers.ValidationError(errors)
         return data
 
     def get_ingredients(self, obj):
         return IngredientRecipeSerializer(
-            IngredientRecipe.objects.filter(recipe=obj),
+            obj.ingredient.all(),
             many=True
         ).data
 
     def get_is_favorited(self, obj):
+        if hasattr(obj, 'is_favorited'):
+            return obj.is_favorited
         user = self.context.get('request').user
         if user.is_anonymous:
             return False
@@ -146,6 +357,8 @@ class RecipeSerializer(serializers.ModelSerializer):
         ).exists()
 
     def get_is_in_shopping_cart(self, obj):
+        if hasattr(obj, 'is_in_shopping_cart'):
+            return obj.is_in_shopping_cart
         user = self.context.get('request').user
         if not user or user.is_anonymous:
             return False
@@ -158,48 +371,88 @@ class RecipeSerializer(serializers.ModelSerializer):
         image = validated_data.pop('image')
         ingredients = validated_data.pop('ingredients')
         tags = validated_data.pop('tags')
-        recipe = Recipe.objects.create(image=image, **validated_data)
-        recipe.tags.set(tags)
-        self._create_ingredients(recipe, ingredients)
+        with transaction.atomic():
+            recipe = Recipe.objects.create(image=image, **validated_data)
+            recipe.tags.set(tags)
+            self._create_ingredients(recipe, ingredients)
         return recipe
 
     def update(self, instance, validated_data):
-        instance.tags.clear()
-        instance.tags.set(validated_data.pop('tags'))
-        IngredientRecipe.objects.filter(recipe=instance).delete()
-        self._create_ingredients(
-            recipe=instance,
-            ingredients=validated_data.pop('ingredients')
-        )
-        super().update(instance, validated_data)
+        tags = validated_data.pop('tags')
+        ingredients = validated_data.pop('ingredients')
+        with transaction.atomic():
+            instance.tags.set(tags)
+            ingredients_changed = self._update_ingredients(
+                instance, ingredients
+            )
+            super().update(instance, validated_data)
+            if ingredients_changed:
+                shopping_list.rebuild_for_recipe(instance.id)
         return instance
 
 
 class FavoriteOrFollowSerializer(serializers.ModelSerializer):
     image = Base64ImageField()
+    image_variants = ImageVariantsField()
 
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'image', 'cooking_time')
-        read_only_fields = ('id', 'name', 'image', 'cooking_time')
+        fields = (
+            'id', 'name', 'image', 'image_variants', 'image_placeholder',
+            'cooking_time'
+        )
+        read_only_fields = (
+            'id', 'name', 'image', 'image_placeholder', 'cooking_time'
+        )
 
 
-class FollowSerializer(serializers.ModelSerializer):
-    id = serializers.ReadOnlyField(source='author.id')
-    email = serializers.ReadOnlyField(source='author.email')
-    username = serializers.ReadOnlyField(source='author.username')
-    first_name = serializers.ReadOnlyField(source='author.first_name')
-    last_name = serializers.ReadOnlyField(source='author.last_name')
-    is_subscribed = serializers.SerializerMethodField()
+class RecipeIdsSerializer(serializers.Serializer):
+    recipes = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=MAX_PAGE_SIZE,
+    )
+
+    def validate_recipes(self, value):
+        return list(dict.fromkeys(value))
+
+
+class SubscriptionListSerializer(serializers.ListSerializer):
+    """Подписки из строк values() авторов собираются api.readers."""
+
+    def to_representation(self, data):
+        authors = data.all() if hasattr(data, 'all') else data
+        if authors and all(isinstance(author, dict) for author in authors):
+            return readers.subscriptions(
+                authors, get_recipes_limit(self.context.get('request'))
+            )
+        return super().to_representation(data)
+
+
+class SubscriptionSerializer(UserSerializer):
     recipes = serializers.SerializerMethodField()
-    recipes_count = serializers.SerializerMethodField()
+    recipes_count = serializers.IntegerField(read_only=True)
+
+    class Meta(UserSerializer.Meta):
+        fields = UserSerializer.Meta.fields + ('recipes', 'recipes_count')
+        list_serializer_class = SubscriptionListSerializer
+
+    def get_recipes(self, obj):
+        recipes_set = Recipe.objects.filter(author=obj)
+        limit = get_recipes_limit(self.context.get('request'))
+        if limit:
+            recipes_set = recipes_set[:limit]
+        return FavoriteOrFollowSerializer(
+            recipes_set,
+            many=True
+        ).data
+
+
+class FollowSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Follow
-        fields = (
-            'id', 'email', 'username', 'first_name', 'last_name',
-            'is_subscribed', 'recipes', 'recipes_count',
-        )
+        fields = ('user', 'author')
 
     def to_internal_value(self, data):
         return data
@@ -224,22 +477,14 @@ class FollowSerializer(serializers.ModelSerializer):
         return data
 
     def create(self, validated_data):
-        return Follow.objects.create(**validated_data)
-
-    def get_is_subscribed(self, obj):
-        return Follow.objects.filter(
-            user=obj.user, author=obj.author
-        ).exists()
-
-    def get_recipes(self, obj):
-        recipes_set = Recipe.objects.filter(author=obj.author)
-        limit = self.context.get('request').GET.get('recipes_limit')
-        if limit:
-            recipes_set = recipes_set[:int(limit)]
-        return FavoriteOrFollowSerializer(
-            recipes_set,
-            many=True
+        follow = Follow.objects.create(**validated_data)
+        request = self.context.get('request')
+        if request is not None:
+            SubscriptionResolver.for_request(request).subscribe(follow.author)
+        return follow
+
+    def to_representation(self, instance):
+        return SubscriptionSerializer(
+            instance.author,
+            context=self.context
         ).data
-
-    def get_recipes_count(self, obj):
-        return Recipe.objects.filter(author=obj.author).count()
@@ -0,0 +1,31 @@
+from django.contrib.auth import get_user_model
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from api.authentication import forget_tokens
+from api.filters import UnicodeLower, unicode_lower
+
+User = get_user_model()
+
+
+@receiver(post_delete, sender=Token)
+def forget_deleted_token(instance, **kwargs):
+    forget_tokens(instance.key)
+
+
+@receiver(post_save, sender=User)
+def forget_user_tokens(instance, created, **kwargs):
+    if not created:
+        forget_tokens(*Token.objects.filter(
+            user_id=instance.pk
+        ).values_list('key', flat=True))
+
+
+@receiver(connection_created)
+def register_unicode_lower(connection, **kwargs):
+    if connection.vendor == 'sqlite':
+        connection.connection.create_function(
+            UnicodeLower.function, 1, unicode_lower
+        )
@@ -0,0 +1,1090 @@
+import csv
+import gzip
+import io
+import json
+from base64 import b64encode, urlsafe_b64encode
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.db import IntegrityError, connection
+from django.db.models import F, Sum
+from django.test import TestCase
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+
+from api.authentication import CachedTokenAuthentication, token_cache_key
+from api.checks import check_shared_cache
+from api.parsers import ContentLengthLimitMixin
+from api.serializers import RecipeSerializer, SubscriptionSerializer
+from foodgram.settings import SHOPPING_LIST_FORMAT
+from recipes.catalog import reference_catalog
+from recipes.models import (
+    Favorite, Ingredient, IngredientRecipe, Recipe, ShoppingCart,
+    ShoppingList, ShoppingListItem, Tag
+)
+from users.models import Follow
+
+User = get_user_model()
+
+
+def create_user(number):
+    return User.objects.create_user(
+        email=f'user{number}@example.com',
+        username=f'user{number}',
+        first_name=f'Имя{number}',
+        last_name=f'Фамилия{number}',
+        password='test-password',
+    )
+
+
+def shopping_list(user):
+    """Сводный список покупок и список, посчитанный по корзине."""
+    return (
+        dict(ShoppingListItem.objects.filter(user=user).values_list(
+            'ingredient_id', 'amount'
+        )),
+        dict(IngredientRecipe.objects.filter(
+            recipe__shopping_cart__user=user
+        ).values_list('ingredient_id').annotate(
+            total=Sum('amount')
+        ).order_by()),
+    )
+
+
+class RecipeDataMixin:
+    """Пользователи, ярлыки, ингредиенты и рецепты для тестов API."""
+
+    recipes_count = 60
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [create_user(number) for number in range(4)]
+        cls.viewer = cls.users[0]
+        cls.tags = [
+            Tag.objects.create(
+                name=f'Ярлык {number}',
+                color=f'#00000{number}',
+                slug=f'tag{number}',
+            )
+            for number in range(3)
+        ]
+        cls.ingredients = [
+            Ingredient.objects.create(
+                name=f'Ингредиент {number}', measurement_unit='г'
+            )
+            for number in range(5)
+        ]
+        cls.recipes = []
+        for number in range(cls.recipes_count):
+            recipe = Recipe.objects.create(
+                author=cls.users[1 + number % 3],
+                name=f'Блины {number}' if number % 2 else f'Суп {number}',
+                image=f'recipe/test{number}.jpg',
+                text=f'Рецепт номер {number}',
+                cooking_time=1 + number % 60,
+            )
+            recipe.tags.set(cls.tags[:1 + number % 3])
+            IngredientRecipe.objects.bulk_create(
+                IngredientRecipe(
+                    recipe=recipe, ingredient=ingredient, amount=number + 1
+                )
+                for ingredient in cls.ingredients[:1 + number % 5]
+            )
+            cls.recipes.append(recipe)
+        for recipe in cls.recipes[::4]:
+            Favorite.objects.create(user=cls.viewer, recipe=recipe)
+        for recipe in cls.recipes[::5]:
+            ShoppingCart.objects.create(user=cls.viewer, recipe=recipe)
+        Follow.objects.create(user=cls.viewer, author=cls.users[1])
+        Follow.objects.create(user=cls.viewer, author=cls.users[2])
+        cls.token = Token.objects.create(user=cls.viewer)
+
+    def setUp(self):
+        cache.clear()
+        reference_catalog.invalidate()
+        reference_catalog.warm()
+        self.anonymous = APIClient()
+        self.client = APIClient()
+        self.client.force_authenticate(self.viewer)
+
+
+class RecipeQueryCountTests(RecipeDataMixin, TestCase):
+    """Число запросов страницы рецептов не зависит от ее размера."""
+
+    def count_queries(self, client, url):
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_list_anonymous(self):
+        with self.assertNumQueries(7):
+            self.anonymous.get('/api/recipes/?limit=2')
+        cache.clear()
+        with self.assertNumQueries(7):
+            self.anonymous.get('/api/recipes/?limit=50')
+
+    def test_list_authenticated(self):
+        with self.assertNumQueries(8):
+            self.client.get('/api/recipes/?limit=2')
+        cache.clear()
+        with self.assertNumQueries(8):
+            self.client.get('/api/recipes/?limit=50')
+
+    def test_list_with_filters(self):
+        for client in (self.anonymous, self.client):
+            self.assertEqual(
+                self.count_queries(
+                    client, '/api/recipes/?limit=2&tags=tag1&tags=tag2'
+                ),
+                self.count_queries(
+                    client, '/api/recipes/?limit=50&tags=tag1&tags=tag2'
+                ),
+            )
+
+    def test_cached_page_does_not_touch_recipe_relations(self):
+        self.client.get('/api/recipes/?limit=50')
+        with self.assertNumQueries(4):
+            self.client.get('/api/recipes/?limit=50')
+
+    def test_retrieve(self):
+        recipe = self.recipes[-1]
+        with self.assertNumQueries(6):
+            self.anonymous.get(f'/api/recipes/{recipe.id}/')
+        cache.clear()
+        with self.assertNumQueries(7):
+            self.client.get(f'/api/recipes/{recipe.id}/')
+
+
+class RecipeSearchTests(RecipeDataMixin, TestCase):
+
+    def search(self, value):
+        response = self.anonymous.get(
+            '/api/recipes/', {'search': value, 'limit': 100}
+        )
+        self.assertEqual(response.status_code, 200)
+        return [recipe['name'] for recipe in response.data['results']]
+
+    def test_search_ignores_cyrillic_case(self):
+        names = self.search('блин')
+        self.assertEqual(len(names), self.recipes_count // 2)
+        self.assertTrue(all(name.startswith('Блины') for name in names))
+        self.assertEqual(self.search('БЛИН'), names)
+
+    def test_search_ranks_name_matches_first(self):
+        recipe = self.recipes[0]
+        recipe.text = 'Подается с блинами'
+        recipe.save()
+        names = self.search('блин')
+        self.assertEqual(names[-1], recipe.name)
+        self.assertEqual(len(names), self.recipes_count // 2 + 1)
+
+
+class CounterTests(RecipeDataMixin, TestCase):
+    """Сохранение устаревшего экземпляра не затирает счетчики."""
+
+    def test_set_password_keeps_user_counters(self):
+        author = User.objects.get(id=self.users[1].id)
+        Follow.objects.create(user=self.users[3], author=author)
+        client = APIClient()
+        client.force_authenticate(author)
+        response = client.post('/api/users/set_password/', {
+            'current_password': 'test-password',
+            'new_password': 'another-password-42',
+        })
+        self.assertEqual(response.status_code, 204, response.data)
+        author = User.objects.get(id=author.id)
+        self.assertTrue(author.check_password('another-password-42'))
+        self.assertEqual(
+            (author.recipes_count, author.followers_count,
+             author.following_count),
+            (self.recipes_count // 3, 2, 0)
+        )
+
+    def test_recipe_update_keeps_recipe_counters(self):
+        recipe = self.recipes[0]
+        Favorite.objects.create(user=self.users[3], recipe=recipe)
+        client = APIClient()
+        client.force_authenticate(recipe.author)
+        response = client.patch(f'/api/recipes/{recipe.id}/', {
+            'name': 'Новое название',
+            'text': recipe.text,
+            'cooking_time': recipe.cooking_time,
+            'tags': [self.tags[0].id],
+            'ingredients': [{'id': self.ingredients[0].id, 'amount': 5}],
+        }, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        recipe = Recipe.objects.get(id=recipe.id)
+        self.assertEqual(recipe.name, 'Новое название')
+        self.assertEqual(
+            (recipe.favorites_count, recipe.in_shopping_cart_count), (2, 1)
+        )
+
+    def test_full_save_of_stale_instance_keeps_counters(self):
+        recipe = Recipe.objects.get(id=self.recipes[0].id)
+        author = User.objects.get(id=recipe.author_id)
+        ShoppingCart.objects.create(user=self.users[3], recipe=recipe)
+        Follow.objects.create(user=self.users[3], author=author)
+        recipe.cooking_time += 1
+        recipe.save()
+        author.first_name = 'Другое'
+        author.save()
+        recipe.refresh_from_db()
+        author.refresh_from_db()
+        self.assertEqual(recipe.in_shopping_cart_count, 2)
+        self.assertEqual(author.followers_count, 2)
+
+
+class CursorTests(RecipeDataMixin, TestCase):
+
+    @staticmethod
+    def encode(values):
+        return urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+    def test_malformed_cursors_are_not_found(self):
+        cursors = (
+            'not-base64!', self.encode({'a': 1}), self.encode([1, 2]),
+            self.encode(['x', 'y', 'z', 'w']),
+            self.encode([None, 1, 'a', 1]),
+            self.encode(['2020-01-01T00:00:00', 'abc', 'a', 1]),
+            self.encode(['2020-01-01T00:00:00', [1], 'a', 1]),
+            self.encode(['2020-01-01T00:00:00', 1, 'a', 10 ** 30]),
+        )
+        for cursor in cursors:
+            for client in (self.anonymous, self.client):
+                with self.subTest(cursor=cursor):
+                    response = client.get(
+                        '/api/recipes/', {'cursor': cursor}
+                    )
+                    self.assertEqual(response.status_code, 404)
+        for cursor in cursors[3:]:
+            with self.subTest(cursor=cursor):
+                response = self.client.get(
+                    '/api/recipes/feed/', {'cursor': cursor}
+                )
+                self.assertEqual(response.status_code, 404)
+        response = self.client.get(
+            '/api/recipes/feed/',
+            {'cursor': self.encode(['abc', 1])}
+        )
+        self.assertEqual(response.status_code, 404)
+
+    def test_cursor_pages_cover_list(self):
+        ids = []
+        response = self.anonymous.get('/api/recipes/?limit=7&cursor=')
+        while True:
+            self.assertEqual(response.status_code, 200)
+            ids.extend(recipe['id'] for recipe in response.data['results'])
+            if not response.data['next']:
+                break
+            response = self.anonymous.get(response.data['next'])
+        self.assertEqual(
+            ids, list(Recipe.objects.values_list('id', flat=True))
+        )
+
+
+@mock.patch('foodgram.middleware.REQUEST_PROFILING', True)
+class ServerTimingTests(RecipeDataMixin, TestCase):
+
+    def timings(self, response):
+        self.assertEqual(response.status_code, 200)
+        return {
+            entry.split(';')[0]: float(entry.split('dur=')[1].split(';')[0])
+            for entry in response['Server-Timing'].split(', ')
+        }
+
+    def test_serializer_and_render_are_timed(self):
+        for url in ('/api/recipes/?limit=50', '/api/users/subscriptions/'):
+            with self.subTest(url=url):
+                timings = self.timings(APIClient().get(
+                    url, HTTP_AUTHORIZATION='Token ' + self.token.key
+                ))
+                self.assertEqual(
+                    set(timings),
+                    {'db', 'serializer', 'render', 'app', 'view', 'total'}
+                )
+                self.assertGreater(timings['serializer'], 0)
+                self.assertGreater(timings['render'], 0)
+                self.assertLessEqual(
+                    timings['db'] + timings['serializer'] + timings['render'],
+                    timings['view'] + 0.3
+                )
+
+    @mock.patch('foodgram.middleware.SLOW_REQUEST_THRESHOLD_MS', 0)
+    def test_streamed_body_is_measured(self):
+        with CaptureQueriesContext(connection) as queries:
+            with self.assertLogs('foodgram.profiling') as logs:
+                response = self.client.get(
+                    '/api/recipes/download_shopping_cart/'
+                )
+                self.assertTrue(response.streaming)
+                b''.join(response.streaming_content)
+        self.assertIn('body;desc=', response['Server-Timing'])
+        self.assertEqual(len(logs.output), 1)
+        self.assertIn(f'{len(queries)} queries', logs.output[0])
+
+
+class TokenAuthenticationTests(RecipeDataMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+
+    def test_cached_token_needs_no_queries(self):
+        self.assertEqual(self.client.get('/api/users/me/').status_code, 200)
+        request = APIRequestFactory().get(
+            '/', HTTP_AUTHORIZATION='Token ' + self.token.key
+        )
+        with self.assertNumQueries(0):
+            user, token = CachedTokenAuthentication().authenticate(request)
+        self.assertEqual(user, self.viewer)
+        self.assertEqual(user.email, self.viewer.email)
+        self.assertIn('password', user.get_deferred_fields())
+        self.assertTrue(user.check_password('test-password'))
+
+    def test_user_save_forgets_token(self):
+        self.client.get('/api/users/me/')
+        user = User.objects.get(id=self.viewer.id)
+        user.first_name = 'Новое'
+        user.save()
+        self.assertIsNone(cache.get(token_cache_key(self.token.key)))
+        response = self.client.get('/api/users/me/')
+        self.assertEqual(response.data['first_name'], 'Новое')
+
+    def test_inactive_user_is_rejected_with_cached_token(self):
+        self.client.get('/api/users/me/')
+        user = User.objects.get(id=self.viewer.id)
+        user.is_active = False
+        user.save()
+        self.assertEqual(self.client.get('/api/users/me/').status_code, 401)
+
+    def test_logout_forgets_token(self):
+        self.client.get('/api/users/me/')
+        self.assertEqual(
+            self.client.post('/api/auth/token/logout/').status_code, 204
+        )
+        self.assertIsNone(cache.get(token_cache_key(self.token.key)))
+        self.assertEqual(self.client.get('/api/users/me/').status_code, 401)
+
+    def test_deploy_check_requires_shared_cache(self):
+        self.assertEqual(
+            [error.id for error in check_shared_cache(None)], ['api.E001']
+        )
+        with self.settings(CACHES={'default': {
+            'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+            'LOCATION': '127.0.0.1:11211',
+        }}):
+            self.assertEqual(check_shared_cache(None), [])
+
+
+class RecipeFragmentTests(RecipeDataMixin, TestCase):
+    """Фрагменты рецептов меняются вместе с updated_at в базе, без
+    сигналов в этом процессе."""
+
+    def first_recipe(self):
+        return self.anonymous.get('/api/recipes/?limit=1').data['results'][0]
+
+    def test_recipe_change_is_visible(self):
+        recipe = self.first_recipe()
+        Recipe.objects.filter(id=recipe['id']).update(
+            name='Другое название', updated_at=timezone.now()
+        )
+        self.assertEqual(self.first_recipe()['name'], 'Другое название')
+
+    def test_author_change_is_visible(self):
+        recipe = self.first_recipe()
+        User.objects.filter(id=recipe['author']['id']).update(
+            first_name='Другое', updated_at=timezone.now()
+        )
+        self.assertEqual(self.first_recipe()['author']['first_name'], 'Другое')
+
+    def test_tags_change_is_visible(self):
+        recipe = self.first_recipe()
+        Recipe.objects.get(id=recipe['id']).tags.set([self.tags[2]])
+        self.assertEqual(
+            [tag['slug'] for tag in self.first_recipe()['tags']], ['tag2']
+        )
+        self.tags[2].recipes.clear()
+        self.assertEqual(self.first_recipe()['tags'], [])
+
+    def test_unchanged_recipe_is_served_from_cache(self):
+        recipe = self.first_recipe()
+        Recipe.objects.filter(id=recipe['id']).update(name='Без версии')
+        self.assertEqual(self.first_recipe()['name'], recipe['name'])
+
+
+class SerializerParityTests(RecipeDataMixin, TestCase):
+    """Быстрые списки совпадают с сериализаторами отдельных объектов."""
+
+    def setUp(self):
+        super().setUp()
+        Favorite.objects.create(user=self.users[3], recipe=self.recipes[1])
+        ShoppingCart.objects.create(
+            user=self.users[3], recipe=self.recipes[3]
+        )
+        Follow.objects.create(user=self.users[3], author=self.users[1])
+        Recipe.objects.filter(
+            id__in=[recipe.id for recipe in self.recipes[::2]]
+        ).update(image_variants_for=F('image'), image_placeholder='data:,')
+        self.other = APIClient()
+        self.other.force_authenticate(self.users[3])
+        self.viewers = (
+            (self.anonymous, AnonymousUser()),
+            (self.client, self.viewer),
+            (self.other, self.users[3]),
+        )
+
+    @staticmethod
+    def context(user, url):
+        request = Request(APIRequestFactory().get(url))
+        request.user = user
+        return {'request': request}
+
+    def assert_recipes_match(self, client, user, url):
+        response = client.get(url)
+        self.assertEqual(response.status_code, 200)
+        results = response.data.get('results', response.data)
+        self.assertTrue(results)
+        recipes = Recipe.objects.in_bulk([recipe['id'] for recipe in results])
+        for recipe in results:
+            self.assertEqual(
+                recipe,
+                RecipeSerializer(
+                    recipes[recipe['id']], context=self.context(user, url)
+                ).data
+            )
+        return response
+
+    def test_recipe_list(self):
+        urls = (
+            '/api/recipes/?limit=50',
+            '/api/recipes/?limit=50&tags=tag1&tags=tag2',
+            f'/api/recipes/?author={self.users[2].id}',
+            '/api/recipes/?is_favorited=1&limit=50',
+            '/api/recipes/?is_in_shopping_cart=1&limit=50',
+            '/api/recipes/?search=блин',
+        )
+        for client, user in self.viewers:
+            for url in urls:
+                if user.is_anonymous and 'is_' in url:
+                    continue
+                with self.subTest(user=user, url=url):
+                    self.assert_recipes_match(client, user, url)
+
+    def test_recipe_list_twice_from_cache(self):
+        for client, user in self.viewers:
+            with self.subTest(user=user):
+                self.assert_recipes_match(client, user, '/api/recipes/')
+                self.assert_recipes_match(client, user, '/api/recipes/')
+
+    def test_cursor_pages(self):
+        for client, user in self.viewers:
+            with self.subTest(user=user):
+                url = '/api/recipes/?limit=25&cursor='
+                while url:
+                    url = self.assert_recipes_match(
+                        client, user, url
+                    ).data['next']
+
+    def test_recipe_detail(self):
+        for client, user in self.viewers:
+            for recipe in self.recipes[:5]:
+                with self.subTest(user=user, recipe=recipe.id):
+                    url = f'/api/recipes/{recipe.id}/'
+                    self.assertEqual(
+                        client.get(url).data,
+                        RecipeSerializer(
+                            Recipe.objects.get(id=recipe.id),
+                            context=self.context(user, url)
+                        ).data
+                    )
+
+    def test_feed(self):
+        url = '/api/recipes/feed/?limit=15'
+        while url:
+            url = self.assert_recipes_match(
+                self.client, self.viewer, url
+            ).data['next']
+
+    def test_subscriptions(self):
+        for limit in ('', '1', '2', '100', '0', 'abc'):
+            url = f'/api/users/subscriptions/?recipes_limit={limit}'
+            with self.subTest(recipes_limit=limit):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                authors = response.data['results']
+                self.assertEqual(
+                    [author['id'] for author in authors],
+                    [self.users[2].id, self.users[1].id]
+                )
+                for author in authors:
+                    self.assertEqual(
+                        author,
+                        SubscriptionSerializer(
+                            User.objects.get(id=author['id']),
+                            context=self.context(self.viewer, url)
+                        ).data
+                    )
+
+
+class BatchTests(RecipeDataMixin, TestCase):
+    """Пакетное добавление и удаление избранного и корзины."""
+
+    def counters(self, field):
+        return dict(Recipe.objects.values_list('id', field))
+
+    def test_add_favorites(self):
+        before = self.counters('favorites_count')
+        new, added = self.recipes[1], self.recipes[0]
+        response = self.client.post('/api/recipes/favorite/', {
+            'recipes': [new.id, added.id, 10 ** 6, new.id],
+        }, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(response.data['results'], [
+            {'id': new.id, 'status': 'added'},
+            {'id': added.id, 'errors': 'Рецепт уже добавлен.'},
+            {'id': 10 ** 6, 'errors': 'Рецепт не найден.'},
+        ])
+        self.assertTrue(
+            Favorite.objects.filter(user=self.viewer, recipe=new).exists()
+        )
+        before[new.id] += 1
+        self.assertEqual(self.counters('favorites_count'), before)
+
+    def test_add_to_shopping_cart(self):
+        before = self.counters('in_shopping_cart_count')
+        ids = [recipe.id for recipe in self.recipes[:4]]
+        response = self.client.post(
+            '/api/recipes/shopping_cart/', {'recipes': ids}, format='json'
+        )
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(
+            [result.get('status') for result in response.data['results']],
+            [None, 'added', 'added', 'added']
+        )
+        for pk in ids[1:]:
+            before[pk] += 1
+        self.assertEqual(self.counters('in_shopping_cart_count'), before)
+        actual, expected = shopping_list(self.viewer)
+        self.assertEqual(actual, expected)
+
+    def test_remove_from_shopping_cart(self):
+        before = self.counters('in_shopping_cart_count')
+        removed, missing = self.recipes[5], self.recipes[1]
+        response = self.client.delete('/api/recipes/shopping_cart/', {
+            'recipes': [removed.id, missing.id],
+        }, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(response.data['results'], [
+            {'id': removed.id, 'status': 'removed'},
+            {'id': missing.id,
+             'errors': 'Объект не существует или уже удален'},
+        ])
+        before[removed.id] -= 1
+        self.assertEqual(self.counters('in_shopping_cart_count'), before)
+        actual, expected = shopping_list(self.viewer)
+        self.assertEqual(actual, expected)
+
+    def test_invalid_payloads(self):
+        for data in ({}, {'recipes': []}, {'recipes': ['x']},
+                     {'recipes': [0]}):
+            with self.subTest(data=data):
+                response = self.client.post(
+                    '/api/recipes/favorite/', data, format='json'
+                )
+                self.assertEqual(response.status_code, 400)
+
+    def test_requires_authentication(self):
+        response = self.anonymous.post(
+            '/api/recipes/favorite/', {'recipes': [1]}, format='json'
+        )
+        self.assertEqual(response.status_code, 401)
+
+
+class ShoppingListDownloadTests(RecipeDataMixin, TestCase):
+    """Выгрузка списка покупок в txt, CSV и JSON Lines."""
+
+    url = '/api/recipes/download_shopping_cart/'
+
+    def download(self, accept):
+        response = self.client.get(self.url, HTTP_ACCEPT=accept)
+        self.assertEqual(response.status_code, 200)
+        content = (
+            b''.join(response.streaming_content) if response.streaming
+            else response.content
+        )
+        return response, content.decode()
+
+    def expected(self):
+        amounts, _ = shopping_list(self.viewer)
+        self.assertTrue(amounts)
+        return [
+            (ingredient.name, ingredient.measurement_unit,
+             amounts[ingredient.id])
+            for ingredient in self.ingredients if ingredient.id in amounts
+        ]
+
+    def test_text(self):
+        for accept in ('text/plain', 'application/pdf'):
+            with self.subTest(accept=accept):
+                response, content = self.download(accept)
+                self.assertTrue(response['Content-Type'].startswith(
+                    'text/plain'
+                ))
+                self.assertIn('shopping_cart.txt', response[
+                    'Content-Disposition'
+                ])
+                self.assertEqual(content, '\n'.join(
+                    SHOPPING_LIST_FORMAT.format(*row)
+                    for row in self.expected()
+                ))
+
+    def test_csv(self):
+        response, content = self.download('text/csv')
+        self.assertIn('shopping_cart.csv', response['Content-Disposition'])
+        self.assertEqual(
+            list(csv.reader(io.StringIO(content))),
+            [['name', 'measurement_unit', 'amount']] + [
+                [name, unit, str(amount)]
+                for name, unit, amount in self.expected()
+            ]
+        )
+
+    def test_json_lines(self):
+        response, content = self.download('application/x-ndjson')
+        self.assertIn('shopping_cart.jsonl', response['Content-Disposition'])
+        self.assertEqual(
+            [json.loads(line) for line in content.splitlines()],
+            [
+                {'name': name, 'measurement_unit': unit, 'amount': amount}
+                for name, unit, amount in self.expected()
+            ]
+        )
+
+    def test_cached_download_and_etag(self):
+        response, content = self.download('text/csv')
+        self.assertTrue(response.streaming)
+        cached, cached_content = self.download('text/csv')
+        self.assertFalse(cached.streaming)
+        self.assertEqual(cached_content, content)
+        response = self.client.get(
+            self.url, HTTP_ACCEPT='text/csv',
+            HTTP_IF_NONE_MATCH=cached['ETag']
+        )
+        self.assertEqual(response.status_code, 304)
+
+
+class IngredientSearchTests(TestCase):
+    """Поиск ингредиентов по индексу в памяти."""
+
+    @classmethod
+    def setUpTestData(cls):
+        Ingredient.objects.bulk_create(
+            Ingredient(name=name, measurement_unit='г')
+            for name in (
+                'Ванильный сахар', 'сахарная пудра', 'Сахар', 'Соль',
+                'Ёжевика', 'Тростниковый Сахар',
+            )
+        )
+
+    def setUp(self):
+        reference_catalog.invalidate()
+
+    def search(self, name):
+        response = self.client.get('/api/ingredients/', {'name': name})
+        self.assertEqual(response.status_code, 200)
+        return [ingredient['name'] for ingredient in response.data]
+
+    def test_prefix_matches_come_first(self):
+        self.assertEqual(self.search('сах'), [
+            'Сахар', 'сахарная пудра', 'Ванильный сахар',
+            'Тростниковый Сахар',
+        ])
+
+    def test_case_and_yo_are_ignored(self):
+        self.assertEqual(self.search('САХАР'), self.search('сахар'))
+        self.assertEqual(self.search('ежев'), ['Ёжевика'])
+        self.assertEqual(self.search('ЁЖ'), ['Ёжевика'])
+
+    def test_index_is_rebuilt_after_ingredient_change(self):
+        self.assertEqual(self.search('сол'), ['Соль'])
+        Ingredient.objects.create(name='Соль морская', measurement_unit='г')
+        self.assertEqual(self.search('сол'), ['Соль', 'Соль морская'])
+        ingredient = Ingredient.objects.get(name='Соль')
+        ingredient.name = 'Перец'
+        ingredient.save()
+        self.assertEqual(self.search('сол'), ['Соль морская'])
+        ingredient.delete()
+        self.assertEqual(self.search('пер'), [])
+
+
+class ReferenceDataTests(TestCase):
+    """Пакет справочников с ETag и сжатым телом."""
+
+    url = '/api/reference/'
+
+    @classmethod
+    def setUpTestData(cls):
+        Tag.objects.create(name='Завтрак', color='#000001', slug='breakfast')
+        Ingredient.objects.create(name='Сахар', measurement_unit='г')
+
+    def setUp(self):
+        reference_catalog.invalidate()
+
+    def test_body_and_etag(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('Content-Encoding', response)
+        data = json.loads(response.content)
+        self.assertEqual(data['tags'][0]['slug'], 'breakfast')
+        self.assertEqual(data['ingredients'][0]['name'], 'Сахар')
+        self.assertEqual(response['ETag'], f'"{data["version"]}"')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        response = self.client.get(
+            self.url, HTTP_IF_NONE_MATCH=response['ETag']
+        )
+        self.assertEqual(response.status_code, 304)
+
+    def test_gzip_body_has_own_etag(self):
+        plain = self.client.get(self.url)
+        response = self.client.get(self.url, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(response.content), plain.content)
+        self.assertEqual(response['ETag'], plain['ETag'][:-1] + '-gzip"')
+        self.assertEqual(self.client.get(
+            self.url, HTTP_ACCEPT_ENCODING='gzip',
+            HTTP_IF_NONE_MATCH=response['ETag'],
+        ).status_code, 304)
+        self.assertEqual(self.client.get(
+            self.url, HTTP_IF_NONE_MATCH=response['ETag']
+        ).status_code, 200)
+
+    def test_etag_changes_with_data(self):
+        etag = self.client.get(self.url)['ETag']
+        Tag.objects.create(name='Обед', color='#000002', slug='lunch')
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+
+class ShoppingListAggregateTests(RecipeDataMixin, TestCase):
+    """Сводный список покупок следует за корзиной и составом рецептов."""
+
+    def setUp(self):
+        super().setUp()
+        self.recipe = Recipe.objects.get(id=self.recipes[5].id)
+        ShoppingCart.objects.create(user=self.users[3], recipe=self.recipe)
+
+    def version(self, user):
+        return ShoppingList.objects.get(user=user).version
+
+    def assert_lists_match(self, *users):
+        for user in users:
+            actual, expected = shopping_list(user)
+            self.assertEqual(actual, expected)
+
+    def test_recipe_edit_updates_lists(self):
+        versions = [self.version(user) for user in self.users[::3]]
+        author = APIClient()
+        author.force_authenticate(self.recipe.author)
+        response = author.patch(f'/api/recipes/{self.recipe.id}/', {
+            'name': self.recipe.name,
+            'text': self.recipe.text,
+            'cooking_time': self.recipe.cooking_time,
+            'tags': [self.tags[0].id],
+            'ingredients': [
+                {'id': self.ingredients[0].id, 'amount': 500},
+                {'id': self.ingredients[4].id, 'amount': 7},
+            ],
+        }, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assert_lists_match(*self.users[::3])
+        self.assertEqual(
+            shopping_list(self.users[3])[0],
+            {self.ingredients[0].id: 500, self.ingredients[4].id: 7}
+        )
+        for user, version in zip(self.users[::3], versions):
+            self.assertGreater(self.version(user), version)
+
+    def test_cart_item_delete_updates_list(self):
+        version = self.version(self.viewer)
+        response = self.client.delete(
+            f'/api/recipes/{self.recipe.id}/shopping_cart/'
+        )
+        self.assertEqual(response.status_code, 204)
+        self.assert_lists_match(self.viewer, self.users[3])
+        self.assertGreater(self.version(self.viewer), version)
+
+    def test_last_cart_item_delete_empties_list(self):
+        ShoppingCart.objects.filter(user=self.users[3]).delete()
+        self.assertEqual(shopping_list(self.users[3]), ({}, {}))
+
+    def test_recipe_delete_updates_lists(self):
+        self.recipe.delete()
+        self.assert_lists_match(self.viewer, self.users[3])
+        self.assertEqual(shopping_list(self.users[3])[0], {})
+
+
+def image_bytes(image_format='PNG'):
+    content = io.BytesIO()
+    Image.new('RGB', (4, 4), 'red').save(content, image_format)
+    return content.getvalue()
+
+
+class RecipeImageUploadTests(RecipeDataMixin, TestCase):
+    """Изображение рецепта файлом multipart и строкой base64."""
+
+    url = '/api/recipes/'
+
+    def payload(self, **fields):
+        return {
+            'name': 'Новый рецепт',
+            'text': 'Описание',
+            'cooking_time': 10,
+            'tags': json.dumps([self.tags[0].id]),
+            'ingredients': json.dumps(
+                [{'id': self.ingredients[0].id, 'amount': 3}]
+            ),
+            **fields,
+        }
+
+    def base64_payload(self, content):
+        return {
+            **self.payload(),
+            'tags': [self.tags[0].id],
+            'ingredients': [{'id': self.ingredients[0].id, 'amount': 3}],
+            'image': 'data:image/png;base64,' + b64encode(content).decode(),
+        }
+
+    def test_multipart_upload(self):
+        response = self.client.post(self.url, self.payload(
+            image=SimpleUploadedFile(
+                'photo.png', image_bytes(), content_type='image/png'
+            )
+        ), format='multipart')
+        self.assertEqual(response.status_code, 201, response.data)
+        recipe = Recipe.objects.get(id=response.data['id'])
+        self.assertTrue(recipe.image.name.endswith('.png'))
+        self.assertEqual(
+            [ingredient.amount for ingredient in recipe.ingredient.all()],
+            [3]
+        )
+
+    def test_base64_upload(self):
+        response = self.client.post(
+            self.url, self.base64_payload(image_bytes('JPEG')),
+            format='json'
+        )
+        self.assertEqual(response.status_code, 201, response.data)
+        recipe = Recipe.objects.get(id=response.data['id'])
+        self.assertTrue(recipe.image.name.endswith('.jpg'))
+
+    def test_unknown_image_type_is_rejected(self):
+        response = self.client.post(
+            self.url, self.base64_payload(image_bytes('TIFF')),
+            format='json'
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('формат', str(response.data['image']))
+
+    @mock.patch('api.fields.MAX_IMAGE_SIZE', 64)
+    def test_image_size_limit(self):
+        response = self.client.post(self.url, self.payload(
+            image=SimpleUploadedFile(
+                'photo.png', image_bytes() + bytes(64),
+                content_type='image/png'
+            )
+        ), format='multipart')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('image', response.data)
+        response = self.client.post(
+            self.url, self.base64_payload(image_bytes() + bytes(64)),
+            format='json'
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('image', response.data)
+
+    @mock.patch.object(ContentLengthLimitMixin, 'max_content_length', 1024)
+    def test_request_size_limit(self):
+        for data, request_format in (
+            (self.payload(image=SimpleUploadedFile(
+                'photo.png', bytes(2048), content_type='image/png'
+            )), 'multipart'),
+            (self.base64_payload(bytes(2048)), 'json'),
+        ):
+            with self.subTest(format=request_format):
+                response = self.client.post(
+                    self.url, data, format=request_format
+                )
+                self.assertEqual(response.status_code, 413)
+        self.assertFalse(Recipe.objects.filter(name='Новый рецепт').exists())
+
+
+class RecipeUpdateTests(RecipeDataMixin, TestCase):
+    """Изменение рецепта меняет только отличающиеся строки ингредиентов
+    и выполняется целиком или никак."""
+
+    def setUp(self):
+        super().setUp()
+        self.recipe = self.recipes[4]
+        self.author = APIClient()
+        self.author.force_authenticate(self.recipe.author)
+
+    def rows(self):
+        return {
+            row.ingredient_id: (row.id, row.amount)
+            for row in IngredientRecipe.objects.filter(recipe=self.recipe)
+        }
+
+    def update(self, amounts):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.author.patch(f'/api/recipes/{self.recipe.id}/', {
+                'name': self.recipe.name,
+                'text': self.recipe.text,
+                'cooking_time': self.recipe.cooking_time,
+                'tags': [tag.id for tag in self.recipe.tags.all()],
+                'ingredients': [
+                    {'id': ingredient_id, 'amount': amount}
+                    for ingredient_id, amount in amounts.items()
+                ],
+            }, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        return ' '.join(
+            query['sql'] for query in queries
+            if 'recipes_ingredientrecipe' in query['sql']
+        )
+
+    def test_only_changed_rows_are_written(self):
+        before = self.rows()
+        self.assertEqual(len(before), 5)
+        first, second, *rest = self.ingredients
+        sql = self.update({
+            first.id: before[first.id][1] + 1,
+            **{ingredient.id: before[ingredient.id][1]
+               for ingredient in rest},
+        })
+        self.assertNotIn('INSERT', sql)
+        after = self.rows()
+        self.assertEqual(after[first.id], (
+            before[first.id][0], before[first.id][1] + 1
+        ))
+        self.assertNotIn(second.id, after)
+        for ingredient in rest:
+            self.assertEqual(after[ingredient.id], before[ingredient.id])
+
+    def test_unchanged_ingredients_are_not_written(self):
+        before = self.rows()
+        sql = self.update({
+            ingredient_id: amount
+            for ingredient_id, (_, amount) in before.items()
+        })
+        for statement in ('INSERT', 'UPDATE', 'DELETE'):
+            self.assertNotIn(statement, sql)
+        self.assertEqual(self.rows(), before)
+
+    def test_new_ingredient_is_inserted(self):
+        Ingredient.objects.create(name='Новый', measurement_unit='г')
+        ingredient = Ingredient.objects.get(name='Новый')
+        before = self.rows()
+        self.update({ingredient.id: 9, **{
+            ingredient_id: amount
+            for ingredient_id, (_, amount) in before.items()
+        }})
+        after = self.rows()
+        self.assertEqual(after.pop(ingredient.id)[1], 9)
+        self.assertEqual(after, before)
+
+    def test_create_is_atomic(self):
+        with mock.patch(
+            'api.serializers.RecipeSerializer._create_ingredients',
+            side_effect=IntegrityError
+        ):
+            with self.assertRaises(IntegrityError):
+                self.client.post('/api/recipes/', {
+                    'name': 'Без ингредиентов',
+                    'text': 'Текст',
+                    'cooking_time': 5,
+                    'tags': [self.tags[0].id],
+                    'ingredients': [
+                        {'id': self.ingredients[0].id, 'amount': 1}
+                    ],
+                    'image': 'data:image/png;base64,' + b64encode(
+                        image_bytes()
+                    ).decode(),
+                }, format='json')
+        self.assertFalse(
+            Recipe.objects.filter(name='Без ингредиентов').exists()
+        )
+
+
+class RecipeValidationTests(RecipeDataMixin, TestCase):
+    """Ошибки ингредиентов и ярлыков по позициям, без записи в базу."""
+
+    def post(self, ingredients, tags):
+        return self.client.post('/api/recipes/', {
+            'name': 'Проверка',
+            'text': 'Текст',
+            'cooking_time': 5,
+            'tags': tags,
+            'ingredients': ingredients,
+            'image': 'data:image/png;base64,' + b64encode(
+                image_bytes()
+            ).decode(),
+        }, format='json')
+
+    def test_errors_by_position(self):
+        first, second = self.ingredients[:2]
+        response = self.post(
+            [
+                {'id': first.id, 'amount': 1},
+                {'id': first.id, 'amount': 2},
+                {'id': 10 ** 6, 'amount': 1},
+                {'id': second.id, 'amount': 0},
+                {'id': 'x', 'amount': 1},
+                'x',
+            ],
+            [self.tags[0].id, self.tags[0].id, 10 ** 6, 'x'],
+        )
+        self.assertEqual(response.status_code, 400)
+        ingredients = response.data['ingredients']
+        self.assertEqual(ingredients[0], {})
+        self.assertEqual(list(ingredients[1]), ['id'])
+        self.assertIn(str(10 ** 6), ingredients[2]['id'][0])
+        self.assertEqual(list(ingredients[3]), ['amount'])
+        self.assertEqual(list(ingredients[4]), ['id'])
+        self.assertEqual(list(ingredients[5]), ['non_field_errors'])
+        tags = response.data['tags']
+        self.assertEqual(tags[0], [])
+        self.assertEqual(len(tags), 4)
+        self.assertTrue(all(tags[1:]))
+        self.assertFalse(Recipe.objects.filter(name='Проверка').exists())
+
+    def test_existence_is_checked_in_one_query(self):
+        def count_queries(size):
+            ingredients = [
+                {'id': 10 ** 6 + number, 'amount': 1}
+                for number in range(size)
+            ]
+            tags = [10 ** 6 + number for number in range(size)]
+            with CaptureQueriesContext(connection) as queries:
+                response = self.post(ingredients, tags)
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(len(response.data['ingredients']), size)
+            return len(queries)
+
+        self.assertEqual(count_queries(2), count_queries(200))
+
+    def test_empty_payloads(self):
+        response = self.post([], 'x')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(set(response.data), {'ingredients', 'tags'})
@@ -2,8 +2,10 @@ from django.urls import include, path
 from rest_framework.routers import DefaultRouter
 
 from api.views import (
-    IngredientsViewSet, RecipeViewSet, TagsViewSet, UserViewSet
+    IngredientsViewSet, RecipeViewSet, ReferenceDataView, TagsViewSet,
+    UserViewSet
 )
+from foodgram.settings import API_AUTHENTICATION
 
 router_v1 = DefaultRouter()
 router_v1.register('users', UserViewSet, basename='users')
@@ -12,7 +14,14 @@ router_v1.register('ingredients', IngredientsViewSet, basename='ingredients')
 router_v1.register('recipes', RecipeViewSet, basename='recipes')
 
 urlpatterns = [
+    path('reference/', ReferenceDataView.as_view(), name='reference'),
     path('', include(router_v1.urls)),
     path('', include('djoser.urls')),
-    path('auth/', include('djoser.urls.authtoken'), name='auth'),
 ]
+
+if API_AUTHENTICATION == 'jwt':
+    urlpatterns.append(path('auth/', include('djoser.urls.jwt')))
+else:
+    urlpatterns.append(
+        path('auth/', include('djoser.urls.authtoken'), name='auth')
+    )
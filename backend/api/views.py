@@ -1,32 +1,113 @@
+import re
+
 from django.contrib.auth import get_user_model
-from django.db.models import F, Sum
-from django.http import HttpResponse
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Exists, F, OuterRef, Value
+from django.db.models.fields import BooleanField
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.cache import (
+    get_conditional_response, patch_cache_control, patch_vary_headers
+)
+from django.utils.decorators import method_decorator
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
+from django.views.decorators.vary import vary_on_headers
 from django_filters.rest_framework import DjangoFilterBackend
 from djoser.views import UserViewSet as DjoserUserViewSet
 from rest_framework import status, viewsets
 from rest_framework.decorators import action
 from rest_framework.generics import get_object_or_404
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
+from rest_framework.views import APIView
 from rest_framework.viewsets import ReadOnlyModelViewSet
 
-from api.filters import IngredientFilter, RecipeFilter
-from api.pagination import LimitPageNumberPagination
+from api.filters import RecipeFilter
+from api.pagination import FeedPagination, LimitPageNumberPagination
+from api.parsers import BoundedJSONParser, BoundedMultiPartParser
 from api.permissions import IsAdminOrReadOnly, IsOwnerOrReadOnly
+from api.renderers import (
+    SHOPPING_LIST_RENDERERS, FallbackContentNegotiation
+)
+from api.resolvers import SubscriptionResolver
 from api.serializers import (
     FavoriteOrFollowSerializer, FollowSerializer, IngredientSerializer,
-    RecipeSerializer, TagSerializer
+    RecipeIdsSerializer, RecipeSerializer, SubscriptionSerializer,
+    TagSerializer
+)
+from foodgram.metrics import cache_lookup
+from foodgram.middleware import profile_serializer
+from foodgram.settings import (
+    INGREDIENT_SEARCH_LIMIT, REFERENCE_DATA_MAX_AGE,
+    SHOPPING_LIST_CACHE_MAX_SIZE, SHOPPING_LIST_CACHE_TIMEOUT,
+    STREAMING_BATCH_SIZE
 )
-from foodgram.settings import SHOPPING_LIST_FILE_NAME, SHOPPING_LIST_FORMAT
+from recipes import counters, timeline
+from recipes.catalog import reference_catalog, reference_version
 from recipes.models import (
-    Favorite, Ingredient, IngredientRecipe, Recipe, ShoppingCart, Tag
+    Favorite, Ingredient, Recipe, ShoppingCart, ShoppingList, ShoppingListItem,
+    Tag
 )
+from recipes.signals import muted, recipes_added, recipes_removed
 from users.models import Follow
 
 User = get_user_model()
 
+ACCEPTS_GZIP = re.compile(r'\bgzip\b')
+
+
+def accepts_gzip(request):
+    return bool(
+        ACCEPTS_GZIP.search(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+    )
+
 
-class UserViewSet(DjoserUserViewSet):
+def reference_bundle_etag(request):
+    """Сжатое и несжатое тело пакета — разные представления, поэтому
+    и ETag у них разные."""
+    version = reference_version(request)
+    return f'{version}-gzip' if accepts_gzip(request) else version
+
+
+def batched(chunks):
+    batch = []
+    for chunk in chunks:
+        batch.append(chunk)
+        if len(batch) == STREAMING_BATCH_SIZE:
+            yield ''.join(batch)
+            batch = []
+    if batch:
+        yield ''.join(batch)
+
+
+def cached_stream(chunks, cache_key):
+    """Отдает ответ пачками строк и, если он не длиннее
+    SHOPPING_LIST_CACHE_MAX_SIZE символов, кладет его в кеш."""
+    content = []
+    size = 0
+    for batch in batched(chunks):
+        if content is not None:
+            size += len(batch)
+            if size > SHOPPING_LIST_CACHE_MAX_SIZE:
+                content = None
+            else:
+                content.append(batch)
+        yield batch
+    if content is not None:
+        cache.set(cache_key, ''.join(content), SHOPPING_LIST_CACHE_TIMEOUT)
+
+
+class ProfiledSerializerMixin:
+    """Время сериализаторов из get_serializer() в Server-Timing."""
+
+    def get_serializer(self, *args, **kwargs):
+        return profile_serializer(
+            self.request, super().get_serializer(*args, **kwargs)
+        )
+
+
+class UserViewSet(ProfiledSerializerMixin, DjoserUserViewSet):
     pagination_class = LimitPageNumberPagination
 
     @action(
@@ -37,12 +118,13 @@ class UserViewSet(DjoserUserViewSet):
     def subscribe(self, request, id=None):
         request.data['user_id'] = request.user.id
         request.data['author_id'] = int(id)
-        serializer = FollowSerializer(
+        serializer = profile_serializer(request, FollowSerializer(
             data=request.data,
             context={'request': request},
-        )
+        ))
         serializer.is_valid(raise_exception=True)
-        self.perform_create(serializer)
+        with transaction.atomic():
+            self.perform_create(serializer)
         return Response(
             serializer.data,
             status=status.HTTP_201_CREATED,
@@ -50,56 +132,149 @@ class UserViewSet(DjoserUserViewSet):
 
     @subscribe.mapping.delete
     def unsubscribe(self, request, id=None):
-        Follow.objects.filter(
-            user=request.user,
-            author=get_object_or_404(User, id=id)
-        ).delete()
+        author = get_object_or_404(User, id=id)
+        with transaction.atomic():
+            Follow.objects.filter(user=request.user, author=author).delete()
+        SubscriptionResolver.for_request(request).unsubscribe(author)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
     @action(detail=False,
             permission_classes=(IsAuthenticated,))
     def subscriptions(self, request):
-        serializer = FollowSerializer(
-            self.paginate_queryset(Follow.objects.filter(user=request.user)),
+        authors = User.objects.filter(
+            following__user=request.user
+        ).annotate(
+            follow_id=F('following__id'),
+        ).order_by('-follow_id').values(
+            'id', 'email', 'username', 'first_name', 'last_name',
+            'recipes_count', 'follow_id'
+        )
+        serializer = profile_serializer(request, SubscriptionSerializer(
+            self.paginate_queryset(authors),
             many=True,
             context={'request': request}
-        )
+        ))
         return self.get_paginated_response(serializer.data)
 
 
-class TagsViewSet(ReadOnlyModelViewSet):
+class ReferenceDataViewSet(ReadOnlyModelViewSet):
+    """Справочник с условным GET по версии справочников."""
     permission_classes = (IsAdminOrReadOnly,)
+    pagination_class = None
+
+    @method_decorator(condition(etag_func=reference_version))
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
+
+class TagsViewSet(ReferenceDataViewSet):
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
-    pagination_class = None
 
+    @method_decorator(condition(etag_func=reference_version))
+    def list(self, request, *args, **kwargs):
+        return Response(reference_catalog.data.tags)
 
-class IngredientsViewSet(ReadOnlyModelViewSet):
-    permission_classes = (IsAdminOrReadOnly,)
+
+class IngredientsViewSet(ReferenceDataViewSet):
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
-    pagination_class = None
-    filter_backends = (IngredientFilter,)
-    search_fields = ('^name',)
 
+    @method_decorator(condition(etag_func=reference_version))
+    def list(self, request, *args, **kwargs):
+        name = request.query_params.get('name')
+        if name:
+            return Response(reference_catalog.search_ingredients(
+                name, INGREDIENT_SEARCH_LIMIT
+            ))
+        return Response(reference_catalog.data.ingredients.ingredients)
+
+
+class ReferenceDataView(APIView):
+    """Пакет справочников: ярлыки и ингредиенты одним ответом.
 
-class RecipeViewSet(viewsets.ModelViewSet):
-    queryset = Recipe.objects.all()
+    Тело хранится в памяти уже сжатым и отдается с ETag по версии
+    справочников, у сжатого тела с суффиксом -gzip."""
+    authentication_classes = ()
+    permission_classes = (AllowAny,)
+
+    @method_decorator(vary_on_headers('Accept-Encoding'))
+    @method_decorator(cache_control(
+        public=True,
+        max_age=REFERENCE_DATA_MAX_AGE
+    ))
+    @method_decorator(condition(etag_func=reference_bundle_etag))
+    def get(self, request):
+        data = reference_catalog.data
+        if not accepts_gzip(request):
+            return HttpResponse(data.content, content_type='application/json')
+        response = HttpResponse(
+            data.compressed_content,
+            content_type='application/json'
+        )
+        response['Content-Encoding'] = 'gzip'
+        return response
+
+
+class RecipeViewSet(ProfiledSerializerMixin, viewsets.ModelViewSet):
     serializer_class = RecipeSerializer
     pagination_class = LimitPageNumberPagination
     filter_backends = (DjangoFilterBackend,)
     filter_class = RecipeFilter
     permission_classes = (IsOwnerOrReadOnly,)
+    parser_classes = (BoundedJSONParser, BoundedMultiPartParser)
+
+    def get_queryset(self):
+        user = self.request.user
+        if user.is_anonymous:
+            queryset = Recipe.objects.annotate(
+                is_favorited=Value(False, output_field=BooleanField()),
+                is_in_shopping_cart=Value(
+                    False, output_field=BooleanField()
+                ),
+            )
+        else:
+            queryset = Recipe.objects.annotate(
+                is_favorited=Exists(Favorite.objects.filter(
+                    user=user, recipe=OuterRef('pk')
+                )),
+                is_in_shopping_cart=Exists(ShoppingCart.objects.filter(
+                    user=user, recipe=OuterRef('pk')
+                )),
+            )
+        return queryset.annotate(
+            author_updated_at=F('author__updated_at')
+        ).defer('search_vector')
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        rows = queryset.values(
+            'id', 'author_id', 'pub_date', 'name', 'updated_at',
+            *queryset.query.annotations
+        )
+        page = self.paginate_queryset(rows)
+        if page is not None:
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
+        return Response(self.get_serializer(rows, many=True).data)
+
+    def retrieve(self, request, *args, **kwargs):
+        serializer = self.get_serializer([self.get_object()], many=True)
+        return Response(serializer.data[0])
 
     def _add_object(self, model, user, pk):
-        if model.objects.filter(user=user, recipe__id=pk).exists():
-            return Response(
-                {'errors': 'Рецепт уже добавлен.'},
-                status=status.HTTP_400_BAD_REQUEST)
         if model == Favorite or model == ShoppingCart:
             recipe = get_object_or_404(Recipe, id=pk)
-            model.objects.create(user=user, recipe=recipe)
-            serializer = FavoriteOrFollowSerializer(recipe)
+            with transaction.atomic():
+                counters.lock_user(user.id)
+                if model.objects.filter(user=user, recipe=recipe).exists():
+                    return Response(
+                        {'errors': 'Рецепт уже добавлен.'},
+                        status=status.HTTP_400_BAD_REQUEST)
+                model.objects.create(user=user, recipe=recipe)
+            serializer = profile_serializer(
+                self.request, FavoriteOrFollowSerializer(recipe)
+            )
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(
             {'errors': 'Неизвестный метод или модель.'},
@@ -107,11 +282,14 @@ class RecipeViewSet(viewsets.ModelViewSet):
         )
 
     def _delete_object(self, model, user, pk):
-        obj = model.objects.filter(user=user, recipe__id=pk)
-        if obj.exists():
-            obj.delete()
-            return Response(status=status.HTTP_204_NO_CONTENT)
         if model == Favorite or model == ShoppingCart:
+            with transaction.atomic():
+                counters.lock_user(user.id)
+                deleted, _ = model.objects.filter(
+                    user=user, recipe__id=pk
+                ).delete()
+            if deleted:
+                return Response(status=status.HTTP_204_NO_CONTENT)
             return Response(
                 {'errors': 'Объект не существует или уже удален'},
                 status=status.HTTP_400_BAD_REQUEST
@@ -121,6 +299,52 @@ class RecipeViewSet(viewsets.ModelViewSet):
             status=status.HTTP_400_BAD_REQUEST
         )
 
+    def _add_objects(self, model, user, recipe_ids):
+        with transaction.atomic():
+            counters.lock_user(user.id)
+            added = dict(Recipe.objects.filter(id__in=recipe_ids).annotate(
+                added=Exists(model.objects.filter(
+                    user=user, recipe=OuterRef('pk')
+                ))
+            ).values_list('id', 'added'))
+            new_ids = [pk for pk in recipe_ids if added.get(pk) is False]
+            if new_ids:
+                model.objects.bulk_create(
+                    model(user=user, recipe_id=pk) for pk in new_ids
+                )
+                recipes_added(model, user.id, new_ids)
+        results = []
+        for pk in recipe_ids:
+            if pk not in added:
+                results.append({'id': pk, 'errors': 'Рецепт не найден.'})
+            elif added[pk]:
+                results.append({'id': pk, 'errors': 'Рецепт уже добавлен.'})
+            else:
+                results.append({'id': pk, 'status': 'added'})
+        return Response({'results': results})
+
+    def _delete_objects(self, model, user, recipe_ids):
+        objects = model.objects.filter(user=user, recipe__id__in=recipe_ids)
+        with transaction.atomic(), muted():
+            counters.lock_user(user.id)
+            present = set(objects.values_list('recipe_id', flat=True))
+            if present:
+                objects.filter(recipe__id__in=present).delete()
+                recipes_removed(model, user.id, present)
+        return Response({'results': [
+            {'id': pk, 'status': 'removed'} if pk in present else
+            {'id': pk, 'errors': 'Объект не существует или уже удален'}
+            for pk in recipe_ids
+        ]})
+
+    def _batch(self, model, request):
+        serializer = RecipeIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        recipe_ids = serializer.validated_data['recipes']
+        if request.method == 'POST':
+            return self._add_objects(model, request.user, recipe_ids)
+        return self._delete_objects(model, request.user, recipe_ids)
+
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
 
@@ -144,25 +368,74 @@ class RecipeViewSet(viewsets.ModelViewSet):
             return self._delete_object(ShoppingCart, request.user, pk)
         return None
 
+    @action(detail=False,
+            methods=['post', 'delete'],
+            permission_classes=[IsAuthenticated],
+            url_path='favorite',
+            url_name='favorite-batch')
+    def favorite_batch(self, request):
+        return self._batch(Favorite, request)
+
+    @action(detail=False,
+            methods=['post', 'delete'],
+            permission_classes=[IsAuthenticated],
+            url_path='shopping_cart',
+            url_name='shopping-cart-batch')
+    def shopping_cart_batch(self, request):
+        return self._batch(ShoppingCart, request)
+
+    @action(detail=False,
+            permission_classes=(IsAuthenticated,),
+            pagination_class=FeedPagination)
+    def feed(self, request):
+        page = self.paginate_queryset(
+            lambda cursor, limit: timeline.page(request.user, cursor, limit)
+        )
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
     @action(detail=False, methods=['get'],
-            permission_classes=(IsAuthenticated,))
+            permission_classes=(IsAuthenticated,),
+            renderer_classes=SHOPPING_LIST_RENDERERS,
+            content_negotiation_class=FallbackContentNegotiation)
     def download_shopping_cart(self, request):
-        shopping_list = IngredientRecipe.objects.filter(
-            recipe__shopping_cart__user=request.user).values(
-            name=F('ingredient__name'),
-            measurement_unit=F('ingredient__measurement_unit')
-        ).annotate(total_amount=Sum('amount'))
-        text = '\n'.join([
-            SHOPPING_LIST_FORMAT.format(
-                item['name'],
-                item['measurement_unit'],
-                item['total_amount']
+        renderer = request.accepted_renderer
+        version = ShoppingList.objects.filter(
+            user=request.user
+        ).values_list('version', flat=True).first() or 0
+        etag = f'"{request.user.id}-{version}-{renderer.format}"'
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            cache_key = (
+                f'shopping_list:{request.user.id}:{version}:{renderer.format}'
             )
-            for item in shopping_list
-        ])
-        response = HttpResponse(text, content_type='text/plain')
-        response['Content-Disposition'] = (
-            f'attachment; '
-            f'filename={SHOPPING_LIST_FILE_NAME}'
-        )
+            content = cache.get(cache_key)
+            cache_lookup('shopping_list', content is not None)
+            if content is None:
+                items = ShoppingListItem.objects.filter(
+                    user=request.user
+                ).values(
+                    'amount',
+                    name=F('ingredient__name'),
+                    measurement_unit=F('ingredient__measurement_unit'),
+                ).order_by('ingredient__name')
+                response = StreamingHttpResponse(
+                    cached_stream(
+                        renderer.stream(items.iterator()),
+                        cache_key
+                    ),
+                    content_type=renderer.media_type
+                )
+            else:
+                response = HttpResponse(
+                    content,
+                    content_type=renderer.media_type
+                )
+            response['Content-Disposition'] = (
+                f'attachment; '
+                f'filename={renderer.file_name}'
+            )
+        response['ETag'] = etag
+        patch_cache_control(response, private=True, no_cache=True)
+        patch_vary_headers(response, ('Accept',))
         return response
@@ -0,0 +1,131 @@
+"""Маршрутизация чтения на реплику.
+
+ReplicaRoutingMiddleware решает для каждого запроса, можно ли читать
+с реплики, и сообщает это роутеру через контекстную переменную. Чтение
+уходит на реплику только в безопасных методах, пока реплика отвечает
+и пока у клиента нет свежей записи: после изменяющего запроса его
+чтения REPLICA_STICKY_SECONDS идут на основную базу. Свежая запись
+отмечается короткоживущей cookie и, для клиентов без cookie, в общем
+кеше по их учетным данным."""
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from hashlib import sha256
+
+from django.core.cache import cache
+from django.db import DatabaseError, connections
+from rest_framework.authtoken.models import Token
+
+from foodgram.settings import (
+    REPLICA_COOLDOWN_SECONDS, REPLICA_HEALTH_CHECK_INTERVAL,
+    REPLICA_STICKY_SECONDS
+)
+
+REPLICA = 'replica'
+
+REPLICA_ROUTER = 'foodgram.db.ReplicaRouter'
+
+REPLICA_STICKY_COOKIE = 'replica_sticky'
+
+PRIMARY_ONLY_MODELS = (Token,)
+
+logger = logging.getLogger(__name__)
+
+_read_from_replica = ContextVar('read_from_replica', default=False)
+
+
+class ReplicaHealth:
+    """Проверяет реплику не чаще раза в интервал и после сбоя не
+    использует ее REPLICA_COOLDOWN_SECONDS."""
+
+    def __init__(self):
+        self.checked_at = 0.0
+        self.down_until = 0.0
+
+    def is_available(self):
+        now = time.monotonic()
+        if now < self.down_until:
+            return False
+        if now - self.checked_at < REPLICA_HEALTH_CHECK_INTERVAL:
+            return True
+        self.checked_at = now
+        connection = connections[REPLICA]
+        try:
+            if connection.connection is None:
+                connection.ensure_connection()
+            elif not connection.is_usable():
+                connection.close()
+                connection.ensure_connection()
+        except DatabaseError:
+            logger.warning('Реплика недоступна, чтение идет с основной базы')
+            connection.close()
+            self.down_until = now + REPLICA_COOLDOWN_SECONDS
+            return False
+        return True
+
+
+replica_health = ReplicaHealth()
+
+
+def sticky_key(request):
+    credentials = (
+        request.META.get('HTTP_AUTHORIZATION')
+        or request.COOKIES.get('sessionid')
+    )
+    if not credentials:
+        return None
+    return f'replica_sticky:{sha256(credentials.encode()).hexdigest()}'
+
+
+def can_read_from_replica(request):
+    if REPLICA not in connections.databases:
+        return False
+    if request.method not in ('GET', 'HEAD', 'OPTIONS'):
+        return False
+    if REPLICA_STICKY_COOKIE in request.COOKIES:
+        return False
+    key = sticky_key(request)
+    if key is not None and cache.get(key):
+        return False
+    return replica_health.is_available()
+
+
+def remember_write(request, response):
+    if (
+        request.method in ('GET', 'HEAD', 'OPTIONS')
+        or response.status_code >= 400
+    ):
+        return
+    response.set_cookie(
+        REPLICA_STICKY_COOKIE, '1',
+        max_age=REPLICA_STICKY_SECONDS, httponly=True, samesite='Lax'
+    )
+    key = sticky_key(request)
+    if key is not None:
+        cache.set(key, True, REPLICA_STICKY_SECONDS)
+
+
+@contextmanager
+def replica_reads(enabled):
+    token = _read_from_replica.set(enabled)
+    try:
+        yield
+    finally:
+        _read_from_replica.reset(token)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if _read_from_replica.get() and model not in PRIMARY_ONLY_MODELS:
+            return REPLICA
+        return 'default'
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == 'default'
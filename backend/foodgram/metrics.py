@@ -0,0 +1,61 @@
+"""Метрики Prometheus.
+
+При заданной переменной PROMETHEUS_MULTIPROC_DIR значения каждого
+воркера gunicorn пишутся в файлы этого каталога, а эндпоинт собирает
+их вместе, поэтому ответ не зависит от того, какой воркер его отдал."""
+import os
+
+from django.http import HttpResponse
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram,
+    generate_latest, multiprocess
+)
+
+REQUEST_LATENCY = Histogram(
+    'foodgram_request_duration_seconds',
+    'Request latency by route and status',
+    ('view', 'method', 'status'),
+)
+
+REQUEST_QUERIES = Histogram(
+    'foodgram_request_db_queries',
+    'SQL queries per request by route',
+    ('view', 'method'),
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89, float('inf')),
+)
+
+REQUEST_DB_TIME = Histogram(
+    'foodgram_request_db_duration_seconds',
+    'Time spent in the database per request by route',
+    ('view', 'method'),
+)
+
+CACHE_REQUESTS = Counter(
+    'foodgram_cache_requests_total',
+    'Cache lookups by cache and result (hit or miss)',
+    ('cache', 'result'),
+)
+
+
+def cache_lookup(cache_name, hit):
+    CACHE_REQUESTS.labels(cache_name, 'hit' if hit else 'miss').inc()
+
+
+def route_name(request):
+    """Имя маршрута вида recipes-list или users-subscriptions."""
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unmatched'
+    return match.url_name or match.view_name or 'unnamed'
+
+
+def metrics_view(request):
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return HttpResponse(
+        generate_latest(registry),
+        content_type=CONTENT_TYPE_LATEST
+    )
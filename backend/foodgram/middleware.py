@@ -0,0 +1,302 @@
+"""Профилирование запросов.
+
+QueryLog подключается к каждому соединению с базой через
+execute_wrapper и копит число запросов, их суммарное время и самые
+медленные из них. RequestProfilingMiddleware включается настройкой
+REQUEST_PROFILING: добавляет к ответу заголовок Server-Timing и пишет
+в журнал запросы медленнее SLOW_REQUEST_THRESHOLD_MS; время
+сериализаторов учитывается через profile_serializer(). MetricsMiddleware
+собирает задержки и число запросов к базе по маршрутам для Prometheus,
+ReplicaRoutingMiddleware направляет чтение на реплику.
+
+Тело потокового ответа создается уже после выхода из middleware,
+поэтому его измерение завершается через on_response_end(), когда
+тело отдано целиком или ответ закрыт."""
+import heapq
+import logging
+import time
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+from foodgram.db import (
+    REPLICA, REPLICA_ROUTER, can_read_from_replica, remember_write,
+    replica_reads
+)
+from foodgram.metrics import (
+    REQUEST_DB_TIME, REQUEST_LATENCY, REQUEST_QUERIES, route_name
+)
+from foodgram.settings import (
+    PROMETHEUS_METRICS, REQUEST_PROFILING, SLOW_REQUEST_QUERIES,
+    SLOW_REQUEST_THRESHOLD_MS
+)
+
+logger = logging.getLogger('foodgram.profiling')
+
+
+class QueryLog:
+    """Счетчик SQL-запросов всех соединений внутри блока with."""
+
+    def __init__(self, keep_slowest=0):
+        self.count = 0
+        self.duration = 0.0
+        self.keep_slowest = keep_slowest
+        self.slowest = []
+        self._connections = ()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - started
+            self.count += 1
+            self.duration += duration
+            if self.keep_slowest:
+                item = (duration, self.count, context['connection'].alias, sql)
+                if len(self.slowest) < self.keep_slowest:
+                    heapq.heappush(self.slowest, item)
+                else:
+                    heapq.heappushpop(self.slowest, item)
+
+    def start(self):
+        self._connections = connections.all()
+        for connection in self._connections:
+            connection.execute_wrappers.append(self)
+        return self
+
+    def stop(self):
+        # Измерения потоковых ответов заканчиваются не обязательно
+        # в обратном порядке, поэтому обертка убирается по значению.
+        for connection in self._connections:
+            connection.execute_wrappers.remove(self)
+        self._connections = ()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def slowest_queries(self):
+        return sorted(self.slowest, reverse=True)
+
+
+class ClosingStream:
+    """Тело потокового ответа, вызывающее callback один раз: когда
+    тело отдано целиком или ответ закрыт."""
+
+    def __init__(self, content, callback):
+        self.content = iter(content)
+        self.callback = callback
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self.content)
+        except StopIteration:
+            self.close()
+            raise
+
+    def close(self):
+        if self.callback is not None:
+            callback, self.callback = self.callback, None
+            callback()
+
+
+def on_response_end(response, callback):
+    """Вызывает callback после отдачи ответа: сразу для обычного ответа
+    и после тела для потокового."""
+    if response.streaming:
+        response.streaming_content = ClosingStream(
+            response.streaming_content, callback
+        )
+    else:
+        callback()
+
+
+def view_name(view_func, request):
+    """Имя обработчика вида RecipeViewSet.list для журналов и метрик."""
+    cls = getattr(view_func, 'cls', None)
+    if cls is None:
+        return getattr(view_func, '__qualname__', repr(view_func))
+    method = request.method.lower()
+    actions = getattr(view_func, 'actions', None)
+    if actions:
+        return f'{cls.__name__}.{actions.get(method, method)}'
+    return f'{cls.__name__}.{method}'
+
+
+def milliseconds(seconds):
+    return round(seconds * 1000, 1)
+
+
+def profile_serializer(request, serializer):
+    """Засчитывает to_representation сериализатора ответа в Server-Timing
+    serializer, без времени его запросов к базе. Без профилирования
+    возвращает сериализатор как есть."""
+    request = getattr(request, '_request', request)
+    queries = getattr(request, '_profiling_queries', None)
+    if queries is None:
+        return serializer
+    to_representation = serializer.to_representation
+
+    def profiled(instance):
+        started = time.perf_counter()
+        db_started = queries.duration
+        try:
+            return to_representation(instance)
+        finally:
+            request._profiling_serializer = (
+                getattr(request, '_profiling_serializer', 0.0)
+                + time.perf_counter() - started
+                - (queries.duration - db_started)
+            )
+
+    serializer.to_representation = profiled
+    return serializer
+
+
+class RequestProfilingMiddleware:
+    """Время запроса, базы, сериализаторов, рендеринга и представления
+    в заголовке Server-Timing.
+
+    Время приложения считается как время представления за вычетом
+    базы, сериализаторов и рендеринга ответа."""
+
+    def __init__(self, get_response):
+        if not REQUEST_PROFILING:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        started = time.perf_counter()
+        queries = QueryLog(keep_slowest=SLOW_REQUEST_QUERIES).start()
+        request._profiling_queries = queries
+        try:
+            response = self.get_response(request)
+        except BaseException:
+            queries.stop()
+            raise
+        response['Server-Timing'] = self.server_timing(
+            request, response, started, queries
+        )
+
+        def finish():
+            queries.stop()
+            total = time.perf_counter() - started
+            if total * 1000 >= SLOW_REQUEST_THRESHOLD_MS:
+                self.log_slow_request(request, response, total, queries)
+
+        on_response_end(response, finish)
+        return response
+
+    def server_timing(self, request, response, started, queries):
+        """Значения заголовка на момент отдачи заголовков. У потокового
+        ответа они не включают создание тела, о чем говорит запись
+        body."""
+        total = time.perf_counter() - started
+        view_started = getattr(request, '_profiling_view_started', None)
+        view = 0.0 if view_started is None else (
+            time.perf_counter() - view_started
+        )
+        serializer = getattr(request, '_profiling_serializer', 0.0)
+        render = getattr(request, '_profiling_render', 0.0)
+        app = view - queries.duration - serializer - render
+        entries = [
+            f'db;dur={milliseconds(queries.duration)};'
+            f'desc="{queries.count} queries"',
+            f'serializer;dur={milliseconds(serializer)}',
+            f'render;dur={milliseconds(render)}',
+            f'app;dur={milliseconds(max(app, 0))}',
+            f'view;dur={milliseconds(view)}',
+            f'total;dur={milliseconds(total)}',
+        ]
+        if response.streaming:
+            entries.append('body;desc="streamed, not measured"')
+        return ', '.join(entries)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request._profiling_view = view_name(view_func, request)
+        request._profiling_view_started = time.perf_counter()
+
+    def process_template_response(self, request, response):
+        started = time.perf_counter()
+
+        def rendered(response):
+            request._profiling_render = time.perf_counter() - started
+
+        response.add_post_render_callback(rendered)
+        return response
+
+    def log_slow_request(self, request, response, total, queries):
+        logger.warning(
+            'Slow request %s %s -> %s (%s): %.1f ms, %d queries, '
+            '%.1f ms in db%s',
+            request.method,
+            request.get_full_path(),
+            response.status_code,
+            getattr(request, '_profiling_view', '-'),
+            total * 1000,
+            queries.count,
+            queries.duration * 1000,
+            ''.join(
+                f'\n  {duration * 1000:.1f} ms [{alias}] {sql}'
+                for duration, _, alias, sql in queries.slowest_queries()
+            )
+        )
+
+
+class MetricsMiddleware:
+    """Гистограммы задержки и запросов к базе по маршруту и статусу."""
+
+    def __init__(self, get_response):
+        if not PROMETHEUS_METRICS:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        started = time.perf_counter()
+        queries = QueryLog().start()
+        try:
+            response = self.get_response(request)
+        except BaseException:
+            queries.stop()
+            raise
+
+        def finish():
+            queries.stop()
+            route = route_name(request)
+            REQUEST_LATENCY.labels(
+                route, request.method, response.status_code
+            ).observe(time.perf_counter() - started)
+            REQUEST_QUERIES.labels(route, request.method).observe(
+                queries.count
+            )
+            REQUEST_DB_TIME.labels(route, request.method).observe(
+                queries.duration
+            )
+
+        on_response_end(response, finish)
+        return response
+
+
+class ReplicaRoutingMiddleware:
+    """Включает чтение с реплики для безопасных запросов."""
+
+    def __init__(self, get_response):
+        if (
+            REPLICA not in connections.databases
+            or REPLICA_ROUTER not in settings.DATABASE_ROUTERS
+        ):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with replica_reads(can_read_from_replica(request)):
+            response = self.get_response(request)
+        remember_write(request, response)
+        return response
@@ -22,6 +22,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
 
     'rest_framework',
     'rest_framework.authtoken',
@@ -36,6 +37,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'foodgram.middleware.MetricsMiddleware',
+    'foodgram.middleware.RequestProfilingMiddleware',
+    'foodgram.middleware.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -82,9 +86,28 @@ else:
             'USER': os.getenv('POSTGRES_USER', default='default'),
             'PASSWORD': os.getenv('POSTGRES_PASSWORD', default='default'),
             'HOST': os.getenv('DB_HOST', default='db'),
-            'PORT': os.getenv('DB_PORT', default='5432')
+            'PORT': os.getenv('DB_PORT', default='5432'),
+            'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', default=0)),
         }
     }
+    if os.getenv('DB_REPLICA_HOST'):
+        DATABASES['replica'] = {
+            **DATABASES['default'],
+            'HOST': os.getenv('DB_REPLICA_HOST'),
+            'PORT': os.getenv('DB_REPLICA_PORT', default='5432'),
+            'TEST': {'MIRROR': 'default'},
+        }
+        DATABASE_ROUTERS = ['foodgram.db.ReplicaRouter']
+
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND',
+            default='django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': os.getenv('CACHE_LOCATION', default='foodgram'),
+    }
+}
 
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -116,9 +139,16 @@ DJOSER = {
     },
 }
 
+API_AUTHENTICATION = os.getenv('API_AUTHENTICATION', default='token')
+
+AUTHENTICATION_CLASSES = {
+    'token': 'api.authentication.CachedTokenAuthentication',
+    'jwt': 'rest_framework_simplejwt.authentication.JWTAuthentication',
+}
+
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework.authentication.TokenAuthentication',
+        AUTHENTICATION_CLASSES[API_AUTHENTICATION],
     ),
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.AllowAny',
@@ -157,4 +187,58 @@ SHOPPING_LIST_FORMAT = '{0} ({1}) \u2014 {2}'
 
 SHOPPING_LIST_FILE_NAME = 'shopping_cart.txt'
 
+SHOPPING_LIST_CACHE_TIMEOUT = 60 * 60 * 24
+
+SHOPPING_LIST_CACHE_MAX_SIZE = 64 * 1024
+
+RECIPE_FRAGMENT_TIMEOUT = 60 * 60 * 24
+
+FEED_FANOUT_MAX_FOLLOWERS = 10000
+
+FEED_BACKFILL_RECIPES = 100
+
+STREAMING_BATCH_SIZE = 100
+
+MAX_PAGE_SIZE = 100
+
 MAX_COOKING_TIME = 720
+
+MAX_INGREDIENT_AMOUNT = 32767
+
+MAX_IMAGE_SIZE = 5 * 1024 * 1024
+
+MAX_UPLOAD_SIZE = MAX_IMAGE_SIZE * 4 // 3 + 64 * 1024
+
+RECIPE_IMAGE_VARIANTS = {
+    'card': 300,
+    'detail': 800,
+    'retina': 1600,
+}
+
+RECIPE_IMAGE_PLACEHOLDER_WIDTH = 16
+
+IMAGE_VARIANT_WORKERS = 2
+
+INGREDIENT_SEARCH_LIMIT = 50
+
+REFERENCE_DATA_TTL = 300
+
+REFERENCE_DATA_MAX_AGE = 300
+
+RECIPE_SEARCH_CONFIG = 'russian'
+
+REQUEST_PROFILING = os.getenv('REQUEST_PROFILING', 'False') == 'True'
+
+SLOW_REQUEST_THRESHOLD_MS = int(os.getenv('SLOW_REQUEST_THRESHOLD_MS', 500))
+
+SLOW_REQUEST_QUERIES = 5
+
+PROMETHEUS_METRICS = os.getenv('PROMETHEUS_METRICS', 'True') == 'True'
+
+AUTH_TOKEN_CACHE_TIMEOUT = 300
+
+REPLICA_STICKY_SECONDS = 5
+
+REPLICA_HEALTH_CHECK_INTERVAL = 10
+
+REPLICA_COOLDOWN_SECONDS = 30
@@ -0,0 +1,144 @@
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection, connections
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from prometheus_client import REGISTRY
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from foodgram.db import REPLICA, REPLICA_ROUTER, REPLICA_STICKY_COOKIE
+from foodgram.settings import REPLICA_STICKY_SECONDS
+from recipes.models import Recipe
+
+User = get_user_model()
+
+
+@override_settings(DATABASE_ROUTERS=[REPLICA_ROUTER])
+class ReplicaRoutingTests(TransactionTestCase):
+    """Чтение с реплики, запись и токены на основной базе."""
+
+    databases = {'default', REPLICA}
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            email='user@example.com', username='user',
+            first_name='Имя', last_name='Фамилия', password='test-password'
+        )
+        self.token = Token.objects.create(user=self.user)
+        Recipe.objects.bulk_create(
+            Recipe(
+                author=self.user, name=f'Рецепт {number}', text='Текст',
+                cooking_time=5, image='recipe/test.jpg',
+            )
+            for number in range(3)
+        )
+        self.recipe = Recipe.objects.first()
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+
+    def request(self, method, url):
+        primary = CaptureQueriesContext(connections['default'])
+        replica = CaptureQueriesContext(connections[REPLICA])
+        with primary, replica:
+            response = getattr(self.client, method)(url)
+        self.assertLess(response.status_code, 400)
+        return response, primary, replica
+
+    @staticmethod
+    def tables(queries):
+        return ' '.join(query['sql'] for query in queries)
+
+    def test_safe_reads_go_to_replica(self):
+        _, primary, replica = self.request('get', '/api/recipes/')
+        self.assertIn('recipes_recipe', self.tables(replica))
+        self.assertNotIn('recipes_recipe', self.tables(primary))
+
+    def test_token_is_read_from_primary(self):
+        _, primary, replica = self.request('get', '/api/recipes/')
+        self.assertIn('authtoken_token', self.tables(primary))
+        self.assertNotIn('authtoken_token', self.tables(replica))
+
+    def test_writes_go_to_primary_and_stick(self):
+        response, primary, replica = self.request(
+            'post', f'/api/recipes/{self.recipe.id}/favorite/'
+        )
+        self.assertIn('INSERT', self.tables(primary))
+        self.assertNotIn('recipes_', self.tables(replica))
+        self.assertEqual(
+            response.cookies[REPLICA_STICKY_COOKIE]['max-age'],
+            REPLICA_STICKY_SECONDS
+        )
+        self.client.cookies.clear()
+        _, primary, replica = self.request('get', '/api/recipes/')
+        self.assertIn('recipes_recipe', self.tables(primary))
+        self.assertNotIn('recipes_recipe', self.tables(replica))
+
+    def test_sticky_cookie_alone_keeps_reads_on_primary(self):
+        self.client.cookies[REPLICA_STICKY_COOKIE] = '1'
+        _, primary, replica = self.request('get', '/api/recipes/')
+        self.assertIn('recipes_recipe', self.tables(primary))
+        self.assertEqual(self.tables(replica), '')
+
+
+@mock.patch('foodgram.middleware.PROMETHEUS_METRICS', True)
+class MetricsMiddlewareTests(TestCase):
+    """Задержка и запросы к базе по маршрутам, для потоковых ответов —
+    вместе с телом."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            email='user@example.com', username='user',
+            first_name='Имя', last_name='Фамилия', password='test-password'
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    @staticmethod
+    def observed(view):
+        """Число наблюдений задержки и сумма запросов к базе."""
+        return tuple(
+            REGISTRY.get_sample_value(name, labels) or 0
+            for name, labels in (
+                (
+                    'foodgram_request_duration_seconds_count',
+                    {'view': view, 'method': 'GET', 'status': '200'}
+                ),
+                (
+                    'foodgram_request_db_queries_sum',
+                    {'view': view, 'method': 'GET'}
+                ),
+            )
+        )
+
+    def test_request_is_observed_by_route(self):
+        requests, queries_sum = self.observed('recipes-list')
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(
+                self.client.get('/api/recipes/').status_code, 200
+            )
+        self.assertEqual(
+            self.observed('recipes-list'),
+            (requests + 1, queries_sum + len(queries))
+        )
+
+    def test_streamed_body_is_observed_after_it_is_sent(self):
+        view = 'recipes-download-shopping-cart'
+        requests, queries_sum = self.observed(view)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(
+                '/api/recipes/download_shopping_cart/'
+            )
+            self.assertTrue(response.streaming)
+            self.assertEqual(self.observed(view), (requests, queries_sum))
+            b''.join(response.streaming_content)
+        self.assertEqual(
+            self.observed(view), (requests + 1, queries_sum + len(queries))
+        )
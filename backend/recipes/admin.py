@@ -1,5 +1,6 @@
 from django.contrib import admin
 
+from recipes import shopping_list
 from recipes.models import Favorite, Ingredient, Recipe, ShoppingCart, Tag
 
 
@@ -30,8 +31,13 @@ class RecipeAdmin(admin.ModelAdmin):
     ordering = ('author',)
     empty_value_display = '-пусто-'
 
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        if change:
+            shopping_list.rebuild_for_recipe(form.instance.id)
+
     def get_favorited(self, obj):
-        return obj.favorites.count()
+        return obj.favorites_count
 
     get_favorited.short_description = 'В избранном'
 
@@ -0,0 +1,146 @@
+import bisect
+import gzip
+import hashlib
+import json
+import threading
+import time
+
+from django.db import DatabaseError
+from django.utils.functional import cached_property
+
+from foodgram.metrics import cache_lookup
+from foodgram.settings import REFERENCE_DATA_TTL
+from recipes.models import Ingredient, Tag
+
+
+def normalize(text):
+    """Приводит строку к виду для поиска: без регистра и без «ё»."""
+    return text.casefold().replace('ё', 'е')
+
+
+def dump(data):
+    return json.dumps(
+        data,
+        ensure_ascii=False,
+        separators=(',', ':')
+    ).encode('utf-8')
+
+
+class IngredientIndex:
+    """Отсортированный по названию индекс ингредиентов.
+
+    Сначала отдает совпадения по началу названия, затем по вхождению."""
+
+    def __init__(self, ingredients):
+        self.ingredients = list(ingredients)
+        self.by_name = sorted(
+            self.ingredients,
+            key=lambda item: (normalize(item['name']), item['id'])
+        )
+        self.keys = [normalize(item['name']) for item in self.by_name]
+
+    def __len__(self):
+        return len(self.ingredients)
+
+    def search(self, query, limit=None):
+        query = normalize(query)
+        if not query:
+            return self.by_name[:limit]
+        start = bisect.bisect_left(self.keys, query)
+        end = start
+        while end < len(self.keys) and self.keys[end].startswith(query):
+            end += 1
+        found = self.by_name[start:end]
+        for position, key in enumerate(self.keys):
+            if limit is not None and len(found) >= limit:
+                break
+            if (start <= position < end) or query not in key:
+                continue
+            found.append(self.by_name[position])
+        return found[:limit]
+
+
+class ReferenceData:
+    """Снимок справочников: ярлыки, ингредиенты и их версия.
+
+    Версия — хэш содержимого, поэтому во всех процессах она одинакова
+    для одних и тех же данных. Тело пакета справочников рендерится
+    и сжимается один раз на снимок."""
+
+    def __init__(self, tags, ingredients):
+        self.tags = list(tags)
+        self.ingredients = IngredientIndex(ingredients)
+        self.version = hashlib.sha1(
+            dump([self.tags, self.ingredients.ingredients])
+        ).hexdigest()[:20]
+
+    @cached_property
+    def content(self):
+        return dump({
+            'version': self.version,
+            'tags': self.tags,
+            'ingredients': self.ingredients.ingredients,
+        })
+
+    @cached_property
+    def compressed_content(self):
+        return gzip.compress(self.content)
+
+
+class ReferenceCatalog:
+    """Справочники в памяти процесса.
+
+    Снимок строится при старте процесса или при первом обращении,
+    сбрасывается сигналами моделей Tag и Ingredient и перестраивается
+    не реже, чем раз в REFERENCE_DATA_TTL секунд, чтобы изменения
+    из других процессов тоже доходили до клиентов."""
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._data = None
+        self._built_at = 0
+        self._lock = threading.Lock()
+
+    def _is_stale(self, data):
+        return data is None or time.monotonic() - self._built_at > self.ttl
+
+    @property
+    def data(self):
+        data = self._data
+        if not self._is_stale(data):
+            cache_lookup('reference_catalog', True)
+            return data
+        with self._lock:
+            data = self._data
+            if not self._is_stale(data):
+                cache_lookup('reference_catalog', True)
+                return data
+            cache_lookup('reference_catalog', False)
+            return self._build()
+
+    def _build(self):
+        self._data = ReferenceData(
+            Tag.objects.values('id', 'name', 'color', 'slug'),
+            Ingredient.objects.values('id', 'name', 'measurement_unit'),
+        )
+        self._built_at = time.monotonic()
+        return self._data
+
+    def warm(self):
+        try:
+            return self.data
+        except DatabaseError:
+            return None
+
+    def invalidate(self):
+        self._data = None
+
+    def search_ingredients(self, query, limit=None):
+        return self.data.ingredients.search(query, limit)
+
+
+reference_catalog = ReferenceCatalog(ttl=REFERENCE_DATA_TTL)
+
+
+def reference_version(request, *args, **kwargs):
+    return reference_catalog.data.version
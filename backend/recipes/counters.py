@@ -0,0 +1,57 @@
+"""Денормализованные счетчики рецептов и пользователей.
+
+Счетчики меняются атомарно выражениями F() при создании и удалении
+связанных строк, recount() пересчитывает их целиком."""
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Greatest
+
+from recipes.models import Favorite, Recipe, ShoppingCart
+from users.models import Follow
+
+User = get_user_model()
+
+
+def change(model, pks, **deltas):
+    """Меняет счетчики строк на заданные величины, не опуская ниже 0."""
+    model.objects.filter(pk__in=pks).update(**{
+        field: Greatest(F(field) + delta, 0)
+        for field, delta in deltas.items()
+    })
+
+
+def lock_user(user_id):
+    """Блокирует строку пользователя до конца транзакции, чтобы его
+    добавления и удаления рецептов шли по очереди и проверка наличия
+    строк совпадала с тем, что будет записано.
+
+    SQLite не блокирует строки, поэтому там пустое обновление сразу
+    берет блокировку записи: транзакция, начатая чтением, не смогла бы
+    дождаться ее позже."""
+    users = User.objects.filter(pk=user_id)
+    if connection.features.has_select_for_update:
+        return users.select_for_update().exists()
+    return users.update(id=F('id')) > 0
+
+
+def _count(model, field):
+    return Coalesce(Subquery(
+        model.objects.filter(**{field: OuterRef('pk')}).order_by().values(
+            field
+        ).annotate(total=Count('pk')).values('total')
+    ), 0)
+
+
+def recount():
+    """Пересчитывает все счетчики по фактическим строкам."""
+    with transaction.atomic():
+        Recipe.objects.update(
+            favorites_count=_count(Favorite, 'recipe'),
+            in_shopping_cart_count=_count(ShoppingCart, 'recipe'),
+        )
+        User.objects.update(
+            recipes_count=_count(Recipe, 'author'),
+            followers_count=_count(Follow, 'author'),
+            following_count=_count(Follow, 'user'),
+        )
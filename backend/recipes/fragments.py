@@ -0,0 +1,55 @@
+"""Кеш общей части представления рецептов.
+
+Фрагмент — сериализованный рецепт без полей, зависящих от зрителя,
+с относительными адресами изображений. Ключ фрагмента составлен из id
+рецепта и трех версий, которые одинаковы во всех процессах: updated_at
+рецепта и его автора, прочитанных вместе со строками списка, и версии
+справочников (хэша их содержимого, другие процессы видят ее
+с задержкой до REFERENCE_DATA_TTL). Изменение рецепта, его ярлыков,
+ингредиентов или превью обновляет updated_at в той же транзакции,
+и старые фрагменты перестают читаться, а не удаляются. Версии
+читаются раньше данных фрагмента, поэтому устаревший фрагмент не может
+попасть под новый ключ."""
+from django.core.cache import cache
+from django.utils import timezone
+
+from foodgram.settings import RECIPE_FRAGMENT_TIMEOUT
+from recipes.catalog import reference_catalog
+
+
+def fragment_keys(versions):
+    """Ключи фрагментов по словарю
+    {id рецепта: (updated_at рецепта, updated_at автора)}."""
+    catalog_version = reference_catalog.data.version
+    return {
+        recipe_id: 'recipe_fragment:{0}:{1}:{2}:{3}'.format(
+            recipe_id,
+            catalog_version,
+            recipe_updated_at.isoformat(),
+            author_updated_at.isoformat(),
+        )
+        for recipe_id, (recipe_updated_at, author_updated_at)
+        in versions.items()
+    }
+
+
+def get_many(keys):
+    """Найденные фрагменты по id рецептов."""
+    found = cache.get_many(list(keys.values()))
+    return {
+        recipe_id: found[key]
+        for recipe_id, key in keys.items() if key in found
+    }
+
+
+def set_many(keys, fragments):
+    cache.set_many(
+        {keys[recipe_id]: data for recipe_id, data in fragments.items()},
+        RECIPE_FRAGMENT_TIMEOUT
+    )
+
+
+def touch(recipes):
+    """Меняет версию рецептов, чьи связанные строки изменились
+    без сохранения самого рецепта."""
+    recipes.update(updated_at=timezone.now())
@@ -0,0 +1,148 @@
+"""Превью изображений рецептов.
+
+Для каждого изображения строятся уменьшенные копии из
+RECIPE_IMAGE_VARIANTS в JPEG и WebP и крошечная заглушка в data URI.
+Генерация идет в фоновых потоках процесса после фиксации транзакции,
+чтобы не задерживать ответ на создание или изменение рецепта."""
+import base64
+import io
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+from PIL import Image
+
+from foodgram.settings import (
+    IMAGE_VARIANT_WORKERS, RECIPE_IMAGE_PLACEHOLDER_WIDTH,
+    RECIPE_IMAGE_VARIANTS
+)
+from recipes.models import Recipe
+
+logger = logging.getLogger(__name__)
+
+IMAGE_FORMATS = (
+    ('jpeg', 'JPEG', 'jpg'),
+    ('webp', 'WEBP', 'webp'),
+)
+
+VARIANTS_DIR = 'recipe/variants'
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def variant_path(image_name, variant, extension):
+    stem = os.path.splitext(os.path.basename(image_name))[0]
+    return f'{VARIANTS_DIR}/{stem}_{variant}.{extension}'
+
+
+def variant_paths(image_name):
+    return {
+        variant: {
+            image_format: variant_path(image_name, variant, extension)
+            for image_format, _, extension in IMAGE_FORMATS
+        }
+        for variant in RECIPE_IMAGE_VARIANTS
+    }
+
+
+def _resized(image, width):
+    if image.width <= width:
+        return image
+    return image.resize(
+        (width, max(1, round(image.height * width / image.width))),
+        Image.LANCZOS
+    )
+
+
+def _encode(image, pil_format):
+    buffer = io.BytesIO()
+    image.save(buffer, pil_format, quality=80, optimize=True)
+    return buffer.getvalue()
+
+
+def is_shared(image_name):
+    """Изображение или его превью еще нужны какому-то рецепту, как общая
+    заглушка рецептов из generate_dataset."""
+    return Recipe.objects.filter(
+        Q(image=image_name) | Q(image_variants_for=image_name)
+    ).exists()
+
+
+def delete_variants(image_name):
+    if is_shared(image_name):
+        return
+    for paths in variant_paths(image_name).values():
+        for path in paths.values():
+            default_storage.delete(path)
+
+
+def generate_variants(recipe_id):
+    """Строит превью и заглушку для текущего изображения рецепта."""
+    recipe = Recipe.objects.filter(pk=recipe_id).only(
+        'image', 'image_variants_for'
+    ).first()
+    if recipe is None or not recipe.image:
+        return False
+    image_name = recipe.image.name
+    with default_storage.open(image_name) as image_file:
+        image = Image.open(image_file)
+        image.load()
+    image = image.convert('RGB')
+    for variant, width in RECIPE_IMAGE_VARIANTS.items():
+        resized = _resized(image, width)
+        for _, pil_format, extension in IMAGE_FORMATS:
+            path = variant_path(image_name, variant, extension)
+            default_storage.delete(path)
+            default_storage.save(
+                path,
+                ContentFile(_encode(resized, pil_format))
+            )
+    placeholder = 'data:image/jpeg;base64,' + base64.b64encode(_encode(
+        _resized(image, RECIPE_IMAGE_PLACEHOLDER_WIDTH), 'JPEG'
+    )).decode()
+    updated = Recipe.objects.filter(pk=recipe_id, image=image_name).update(
+        image_placeholder=placeholder,
+        image_variants_for=image_name,
+        updated_at=timezone.now(),
+    )
+    if not updated:
+        delete_variants(image_name)
+        return False
+    if recipe.image_variants_for and recipe.image_variants_for != image_name:
+        delete_variants(recipe.image_variants_for)
+    return True
+
+
+def _run(task, *args):
+    try:
+        task(*args)
+    except Exception:
+        logger.exception('Ошибка обработки изображения рецепта: %s', args)
+    finally:
+        connection.close()
+
+
+def _submit(task, *args):
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=IMAGE_VARIANT_WORKERS,
+                thread_name_prefix='recipe-images'
+            )
+    _executor.submit(_run, task, *args)
+
+
+def schedule_variants(recipe_id):
+    transaction.on_commit(lambda: _submit(generate_variants, recipe_id))
+
+
+def schedule_delete_variants(image_name):
+    transaction.on_commit(lambda: _submit(delete_variants, image_name))
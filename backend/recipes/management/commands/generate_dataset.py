@@ -0,0 +1,272 @@
+import io
+import random
+from contextlib import contextmanager
+from datetime import timedelta
+from itertools import accumulate, islice
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from PIL import Image, ImageDraw
+
+from foodgram.settings import MAX_COOKING_TIME
+from recipes import counters, shopping_list, timeline
+from recipes.images import generate_variants
+from recipes.models import (
+    Favorite, Ingredient, IngredientRecipe, Recipe, ShoppingCart, Tag
+)
+from users.models import Follow
+
+User = get_user_model()
+
+PLACEHOLDER_IMAGE = 'recipe/dataset-placeholder.jpg'
+
+REBUILD_BATCH_SIZE = 500
+
+DISHES = (
+    'суп', 'салат', 'пирог', 'омлет', 'рагу', 'плов', 'каша', 'запеканка',
+    'паста', 'котлеты', 'блинчики', 'оладьи', 'жаркое', 'гуляш', 'борщ',
+    'щи', 'рулет', 'кекс', 'соус', 'смузи',
+)
+
+STYLES = (
+    'по-домашнему', 'по-быстрому', 'по-летнему', 'по-деревенски',
+    'по-итальянски', 'по-грузински', 'по-праздничному', 'по-охотничьи',
+    'с зеленью', 'со специями', 'на скорую руку', 'без глютена',
+)
+
+TEXT = (
+    'Подготовьте продукты. Смешайте ингредиенты, доведите до готовности '
+    'и подавайте горячим. '
+)
+
+
+def power_law_weights(size, exponent):
+    """Накопленные веса Ципфа: первый элемент популярнее всех."""
+    return list(accumulate(1 / (rank + 1) ** exponent for rank in range(size)))
+
+
+def sample_unique(rnd, population, cum_weights, size):
+    size = min(size, len(population))
+    chosen = set()
+    while len(chosen) < size:
+        chosen.update(rnd.choices(
+            population, cum_weights=cum_weights, k=size - len(chosen)
+        ))
+    return chosen
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+@contextmanager
+def explicit_pub_date():
+    """Позволяет задать дату публикации при bulk_create."""
+    field = Recipe._meta.get_field('pub_date')
+    field.auto_now_add = False
+    try:
+        yield
+    finally:
+        field.auto_now_add = True
+
+
+class Command(BaseCommand):
+    help = 'Generate a synthetic dataset of users, recipes and relations'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--recipes', type=int, default=10000)
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=0,
+            help='same seed and initial database give the same dataset',
+        )
+        parser.add_argument(
+            '--exponent',
+            type=float,
+            default=1.1,
+            help='power-law exponent of author and recipe popularity',
+        )
+        parser.add_argument(
+            '--favorites',
+            type=float,
+            default=20,
+            help='average favorites per user',
+        )
+        parser.add_argument(
+            '--cart',
+            type=float,
+            default=5,
+            help='average shopping cart size per user',
+        )
+        parser.add_argument(
+            '--follows',
+            type=float,
+            default=10,
+            help='average followed authors per user',
+        )
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def placeholder_image(self):
+        """Одно изображение на все рецепты вместо файла на каждый."""
+        if not default_storage.exists(PLACEHOLDER_IMAGE):
+            image = Image.new('RGB', (1200, 800), '#F5E6CC')
+            draw = ImageDraw.Draw(image)
+            for step in range(0, 1200, 40):
+                draw.line((step, 0, step + 400, 800), '#E0C9A6', 12)
+            buffer = io.BytesIO()
+            image.save(buffer, 'JPEG', quality=85)
+            default_storage.save(
+                PLACEHOLDER_IMAGE, ContentFile(buffer.getvalue())
+            )
+        return PLACEHOLDER_IMAGE
+
+    def bulk_create(self, model, objects):
+        for batch in batched(objects, self.batch_size):
+            model.objects.bulk_create(batch)
+
+    def create_users(self, count):
+        start = User.objects.count()
+        password = make_password('dataset-password')
+        last_id = User.objects.order_by('-id').values_list(
+            'id', flat=True
+        ).first() or 0
+        self.bulk_create(User, (
+            User(
+                username=f'dataset{number}',
+                email=f'dataset{number}@example.com',
+                first_name=f'Имя{number}',
+                last_name=f'Фамилия{number}',
+                password=password,
+            )
+            for number in range(start, start + count)
+        ))
+        return list(User.objects.filter(id__gt=last_id).order_by(
+            'id'
+        ).values_list('id', flat=True))
+
+    def recipe_rows(self, rnd, authors, count):
+        author_weights = power_law_weights(len(authors), self.exponent)
+        now = timezone.now()
+        image = self.placeholder_image()
+        for number in range(count):
+            yield Recipe(
+                author_id=rnd.choices(authors, cum_weights=author_weights)[0],
+                name=(
+                    f'{rnd.choice(DISHES).capitalize()} '
+                    f'{rnd.choice(STYLES)} №{number}'
+                ),
+                image=image,
+                text=TEXT * rnd.randint(1, 5),
+                cooking_time=min(
+                    int(rnd.lognormvariate(3.3, 0.6)) + 1, MAX_COOKING_TIME
+                ),
+                pub_date=now - timedelta(seconds=rnd.randint(0, 365 * 86400)),
+            )
+
+    def create_recipes(self, rnd, authors, count):
+        ingredients = list(Ingredient.objects.values_list('id', flat=True))
+        tags = list(Tag.objects.values_list('id', flat=True))
+        rnd.shuffle(ingredients)
+        ingredient_weights = power_law_weights(len(ingredients), 0.8)
+        tag_weights = power_law_weights(len(tags), 0.5)
+        through = Recipe.tags.through
+        recipe_ids = []
+        with explicit_pub_date():
+            for batch in batched(
+                self.recipe_rows(rnd, authors, count), self.batch_size
+            ):
+                last_id = Recipe.objects.order_by('-id').values_list(
+                    'id', flat=True
+                ).first() or 0
+                Recipe.objects.bulk_create(batch)
+                ids = list(Recipe.objects.filter(id__gt=last_id).order_by(
+                    'id'
+                ).values_list('id', flat=True))
+                IngredientRecipe.objects.bulk_create(
+                    IngredientRecipe(
+                        recipe_id=recipe_id,
+                        ingredient_id=ingredient_id,
+                        amount=rnd.choice((1, 2, 3, 5, 10, 50, 100, 200)),
+                    )
+                    for recipe_id in ids
+                    for ingredient_id in sample_unique(
+                        rnd, ingredients, ingredient_weights,
+                        rnd.randint(3, 12)
+                    )
+                )
+                through.objects.bulk_create(
+                    through(recipe_id=recipe_id, tag_id=tag_id)
+                    for recipe_id in ids
+                    for tag_id in sample_unique(
+                        rnd, tags, tag_weights, rnd.randint(1, 3)
+                    )
+                )
+                recipe_ids.extend(ids)
+        return recipe_ids
+
+    def relation_rows(self, rnd, model, users, targets, average, field):
+        weights = power_law_weights(len(targets), self.exponent)
+        for user_id in users:
+            size = int(rnd.paretovariate(2) * average / 2)
+            for target_id in sample_unique(rnd, targets, weights, size):
+                if model is not Follow or target_id != user_id:
+                    yield model(user_id=user_id, **{field: target_id})
+
+    def handle(self, *args, **options):
+        if options['users'] < 1 or options['recipes'] < 0:
+            raise CommandError('Нужен хотя бы один пользователь.')
+        self.batch_size = options['batch_size']
+        self.exponent = options['exponent']
+        rnd = random.Random(options['seed'])
+        if not Ingredient.objects.exists() or not Tag.objects.exists():
+            call_command('imprint_initial_data', stdout=self.stdout)
+
+        with transaction.atomic():
+            users = self.create_users(options['users'])
+            authors = users[:]
+            rnd.shuffle(authors)
+            recipes = self.create_recipes(rnd, authors, options['recipes'])
+            recipes_by_popularity = recipes[:]
+            rnd.shuffle(recipes_by_popularity)
+            for model, targets, average, field in (
+                (Favorite, recipes_by_popularity,
+                 options['favorites'], 'recipe_id'),
+                (ShoppingCart, recipes_by_popularity,
+                 options['cart'], 'recipe_id'),
+                (Follow, authors, options['follows'], 'author_id'),
+            ):
+                if targets:
+                    self.bulk_create(model, self.relation_rows(
+                        rnd, model, users, targets, average, field
+                    ))
+            counters.recount()
+            timeline.reset_fan_out()
+            for batch in batched(users, REBUILD_BATCH_SIZE):
+                shopping_list.rebuild(batch)
+                timeline.rebuild(batch)
+
+        if recipes:
+            generate_variants(recipes[0])
+            placeholder = Recipe.objects.filter(id=recipes[0]).values_list(
+                'image_placeholder', flat=True
+            ).get()
+            Recipe.objects.filter(image=PLACEHOLDER_IMAGE).update(
+                image_placeholder=placeholder,
+                image_variants_for=PLACEHOLDER_IMAGE,
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f'Generated {len(users)} users and {len(recipes)} recipes.'
+        ))
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+from django.db.models import F
+
+from recipes.images import generate_variants
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = 'Build resized variants and placeholders for recipe images'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help='rebuild variants for every recipe, not only missing ones',
+        )
+
+    def handle(self, *args, **options):
+        recipes = Recipe.objects.exclude(image='')
+        if not options['all']:
+            recipes = recipes.exclude(image_variants_for=F('image'))
+        built = failed = 0
+        for recipe_id in recipes.values_list('id', flat=True).iterator():
+            try:
+                if generate_variants(recipe_id):
+                    built += 1
+            except (OSError, ValueError) as error:
+                failed += 1
+                self.stderr.write(f'Recipe {recipe_id}: {error}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Variants built: {built}, failed: {failed}.'
+        ))
@@ -1,11 +1,115 @@
+import csv
 import json
-import os
+from itertools import islice
 from pathlib import Path
 
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
 
+from recipes.catalog import reference_catalog
 from recipes.models import Ingredient, Tag
 
+JSON_CHUNK_SIZE = 64 * 1024
+
+COPY_CHUNK_SIZE = 64 * 1024
+
+CREATE_SQL = (
+    'CREATE TEMPORARY TABLE ingredient_import '
+    '(name varchar(200), measurement_unit varchar(50)) ON COMMIT DROP'
+)
+
+COPY_SQL = (
+    'COPY ingredient_import (name, measurement_unit) '
+    'FROM STDIN WITH (FORMAT csv)'
+)
+
+INSERT_SQL = (
+    'INSERT INTO {table} (name, measurement_unit) '
+    'SELECT name, measurement_unit FROM ingredient_import '
+    'ON CONFLICT (name, measurement_unit) DO NOTHING'
+)
+
+
+def skip_separators(buffer, position):
+    while position < len(buffer) and buffer[position] in ' \t\r\n,':
+        position += 1
+    return position
+
+
+def read_json(file):
+    """Читает JSON-массив по элементам, не загружая файл целиком."""
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+    while position == len(buffer):
+        chunk = file.read(JSON_CHUNK_SIZE)
+        if not chunk:
+            break
+        buffer += chunk
+        position = skip_separators(buffer, position)
+    if buffer[position:position + 1] != '[':
+        raise CommandError('Ожидается JSON-массив.')
+    position += 1
+    while True:
+        chunk = file.read(JSON_CHUNK_SIZE)
+        buffer = buffer[position:] + chunk
+        position = skip_separators(buffer, 0)
+        while buffer[position:position + 1] not in (']', ''):
+            try:
+                item, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if not chunk:
+                    raise CommandError('JSON-файл оборван.')
+                break
+            yield item['name'], item['measurement_unit']
+            position = skip_separators(buffer, position)
+        else:
+            if buffer[position:position + 1] == ']' or not chunk:
+                return
+
+
+def read_csv(file):
+    for row in csv.reader(file):
+        if len(row) < 2 or row[:2] == ['name', 'measurement_unit']:
+            continue
+        yield row[0], row[1]
+
+
+class CSVStream:
+    """Файл для COPY FROM STDIN: строки CSV создаются по мере чтения,
+    а не собираются в памяти целиком."""
+
+    class Line:
+        def write(self, value):
+            return value
+
+    def __init__(self, rows):
+        self.rows = iter(rows)
+        self.writer = csv.writer(self.Line())
+        self.buffer = ''
+
+    def read(self, size=-1):
+        chunks = [self.buffer]
+        length = len(self.buffer)
+        while size < 0 or length < size:
+            row = next(self.rows, None)
+            if row is None:
+                break
+            line = self.writer.writerow(row)
+            chunks.append(line)
+            length += len(line)
+        data = ''.join(chunks)
+        if size < 0:
+            size = len(data)
+        self.buffer = data[size:]
+        return data[:size]
+
+
+READERS = {
+    'json': read_json,
+    'csv': read_csv,
+}
+
 
 class Command(BaseCommand):
     help = 'Upload initial data to db'
@@ -14,25 +118,87 @@ class Command(BaseCommand):
         parser.add_argument(
             "--path",
             type=str,
-            help="initial data file path",
+            help="initial data file or directory with ingredients.json",
             default=Path(__file__).parent,
         )
+        parser.add_argument(
+            "--format",
+            choices=READERS,
+            help="ingredients file format, guessed from the extension",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="rows per INSERT when COPY is not available",
+        )
 
-    def handle(self, *args, **options):
-        file_path = options['path']
+    def new_ingredients(self, rows):
+        """Отбрасывает уже существующие, повторяющиеся и неверные строки."""
+        name_length = Ingredient._meta.get_field('name').max_length
+        unit_length = Ingredient._meta.get_field(
+            'measurement_unit'
+        ).max_length
+        seen = set(Ingredient.objects.values_list(
+            'name', 'measurement_unit'
+        ).iterator())
+        for name, unit in rows:
+            name, unit = name.strip(), unit.strip()
+            self.total += 1
+            if (
+                not name or not unit
+                or len(name) > name_length or len(unit) > unit_length
+                or (name, unit) in seen
+            ):
+                continue
+            seen.add((name, unit))
+            yield name, unit
+
+    def copy_ingredients(self, rows):
+        with connection.cursor() as cursor:
+            cursor.execute(CREATE_SQL)
+            cursor.cursor.copy_expert(
+                COPY_SQL, CSVStream(rows), size=COPY_CHUNK_SIZE
+            )
+            cursor.execute(
+                INSERT_SQL.format(table=Ingredient._meta.db_table)
+            )
+            return cursor.rowcount
 
-        with open(
-                os.path.join(file_path, 'ingredients.json'),
-                encoding='utf-8'
-        ) as f:
+    def create_ingredients(self, rows, batch_size):
+        before = Ingredient.objects.count()
+        while True:
+            batch = list(islice(rows, batch_size))
+            if not batch:
+                return Ingredient.objects.count() - before
+            Ingredient.objects.bulk_create(
+                (
+                    Ingredient(name=name, measurement_unit=unit)
+                    for name, unit in batch
+                ),
+                ignore_conflicts=True,
+            )
+
+    def handle(self, *args, **options):
+        file_path = Path(options['path'])
+        if file_path.is_dir():
+            file_path = file_path / 'ingredients.json'
+        file_format = options['format'] or file_path.suffix.lstrip('.')
+        if file_format not in READERS:
+            raise CommandError(f'Неизвестный формат файла: {file_path}')
 
-            data = json.load(f)
-            for item in data:
-                Ingredient.objects.get_or_create(
-                    name=item['name'],
-                    measurement_unit=item['measurement_unit']
-                )
-            f.close()
+        self.total = 0
+        with open(file_path, encoding='utf-8', newline='') as f:
+            rows = self.new_ingredients(READERS[file_format](f))
+            with transaction.atomic():
+                if connection.vendor == 'postgresql':
+                    inserted = self.copy_ingredients(rows)
+                else:
+                    inserted = self.create_ingredients(
+                        rows, options['batch_size']
+                    )
+        if inserted:
+            reference_catalog.invalidate()
 
         tags = (
             ('Завтрак', '#AFB83B', 'breakfast'),
@@ -50,4 +216,7 @@ class Command(BaseCommand):
                 slug=slug
             )
 
-        self.stdout.write(self.style.SUCCESS('Imprint was successful.'))
+        self.stdout.write(self.style.SUCCESS(
+            f'Imprint was successful. Ingredients inserted: {inserted}, '
+            f'skipped: {self.total - inserted}.'
+        ))
@@ -0,0 +1,17 @@
+# Generated by Django 2.2.19 on 2026-10-18 18:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0006_recipe_counters'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['-pub_date', 'author', 'name'], name='recipe_ordering_idx'),
+        ),
+    ]
@@ -0,0 +1,73 @@
+# Generated by Django 2.2.19 on 2026-10-18 18:26
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+from foodgram.settings import FEED_BACKFILL_RECIPES, FEED_FANOUT_MAX_FOLLOWERS
+
+
+def fill_timeline(apps, schema_editor):
+    """Последние FEED_BACKFILL_RECIPES рецептов каждого автора, как при
+    подписке и в timeline.rebuild()."""
+    TimelineEntry = apps.get_model('recipes', 'TimelineEntry')
+    Recipe = apps.get_model('recipes', 'Recipe')
+    Follow = apps.get_model('users', 'Follow')
+    User = apps.get_model('users', 'User')
+    schema_editor.execute(
+        'INSERT INTO {timeline} (user_id, recipe_id, author_id, pub_date) '
+        'SELECT follow.user_id, recipe.id, recipe.author_id, recipe.pub_date '
+        'FROM {follow} follow '
+        'JOIN (SELECT id, author_id, pub_date, ROW_NUMBER() OVER ('
+        'PARTITION BY author_id ORDER BY pub_date DESC, id DESC'
+        ') AS position FROM {recipe}) recipe '
+        'ON recipe.author_id = follow.author_id '
+        'JOIN {user} author ON author.id = follow.author_id '
+        'WHERE author.followers_count <= %s '
+        'AND recipe.position <= %s'.format(
+            timeline=TimelineEntry._meta.db_table,
+            follow=Follow._meta.db_table,
+            recipe=Recipe._meta.db_table,
+            user=User._meta.db_table,
+        ),
+        [FEED_FANOUT_MAX_FOLLOWERS, FEED_BACKFILL_RECIPES]
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('recipes', '0007_recipe_ordering_idx'),
+        ('users', '0002_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TimelineEntry',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('pub_date', models.DateTimeField(verbose_name='Дата публикации')),
+                ('author', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='Автор')),
+                ('recipe', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timeline_entries', to='recipes.Recipe', verbose_name='Рецепт')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timeline', to=settings.AUTH_USER_MODEL, verbose_name='Подписчик')),
+            ],
+            options={
+                'verbose_name': 'Запись ленты',
+                'verbose_name_plural': 'Записи ленты',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='timelineentry',
+            index=models.Index(fields=['user', '-pub_date', '-recipe'], name='timeline_user_pub_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='timelineentry',
+            index=models.Index(fields=['user', 'author'], name='timeline_user_author_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='timelineentry',
+            constraint=models.UniqueConstraint(fields=('user', 'recipe'), name='unique_recipe_in_timeline'),
+        ),
+        migrations.RunPython(fill_timeline, migrations.RunPython.noop),
+    ]
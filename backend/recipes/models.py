@@ -1,9 +1,11 @@
 from django.contrib.auth import get_user_model
+from django.contrib.postgres.search import SearchVectorField
 from django.core.validators import MaxValueValidator, MinValueValidator
 from django.db import models
 
 from foodgram.settings import MAX_COOKING_TIME
 from recipes.validators import validate_color, validate_slug
+from users.models import CounterFieldsMixin
 
 User = get_user_model()
 
@@ -65,7 +67,7 @@ class Tag(DesignatedModel):
         return f'{self.name[:30]}'
 
 
-class Recipe(DesignatedModel):
+class Recipe(CounterFieldsMixin, DesignatedModel):
     author = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
@@ -108,10 +110,52 @@ class Recipe(DesignatedModel):
         db_index=True,
         verbose_name='Дата публикации'
     )
+    updated_at = models.DateTimeField(
+        auto_now=True,
+        verbose_name='Дата изменения'
+    )
+    favorites_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='В избранном'
+    )
+    in_shopping_cart_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='В списках покупок'
+    )
+    image_placeholder = models.TextField(
+        blank=True,
+        editable=False,
+        verbose_name='Заглушка изображения'
+    )
+    image_variants_for = models.CharField(
+        max_length=100,
+        blank=True,
+        editable=False,
+        verbose_name='Изображение, для которого готовы превью'
+    )
+    search_vector = SearchVectorField(
+        null=True,
+        editable=False,
+        verbose_name='Поисковый вектор'
+    )
+
+    counter_fields = ('favorites_count', 'in_shopping_cart_count')
 
     class Meta:
         default_related_name = 'recipes'
         ordering = ('-pub_date', 'author', 'name')
+        indexes = (
+            models.Index(
+                fields=('author', '-pub_date'),
+                name='recipe_author_pub_date_idx'
+            ),
+            models.Index(
+                fields=('-pub_date', 'author', 'name'),
+                name='recipe_ordering_idx'
+            ),
+        )
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
 
@@ -213,3 +257,117 @@ class ShoppingCart(UserRecipeListGenerator):
 
     def __str__(self):
         return f'Список покупок для {self.recipe.name[:30]}'
+
+
+class ShoppingList(models.Model):
+    """Сводный список покупок пользователя.
+
+    Версия увеличивается при каждом изменении списка и служит ключом
+    кеша готового файла."""
+
+    user = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='shopping_list',
+        verbose_name='Пользователь'
+    )
+    version = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Версия'
+    )
+
+    class Meta:
+        verbose_name = 'Сводный список покупок'
+        verbose_name_plural = 'Сводные списки покупок'
+
+    def __str__(self):
+        return f'Сводный список покупок @{self.user.username}'
+
+
+class ShoppingListItem(models.Model):
+    """Суммарное количество ингредиента в списке покупок пользователя."""
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='shopping_list_items',
+        verbose_name='Пользователь'
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        related_name='shopping_list_items',
+        verbose_name='Ингредиент'
+    )
+    amount = models.PositiveIntegerField(
+        verbose_name='Количество'
+    )
+
+    class Meta:
+        verbose_name = 'Позиция списка покупок'
+        verbose_name_plural = 'Позиции списка покупок'
+        constraints = [
+            models.UniqueConstraint(
+                fields=('user', 'ingredient'),
+                name='unique_ingredient_in_shopping_list'
+            )
+        ]
+
+    def __str__(self):
+        return f'{self.ingredient} в списке покупок @{self.user.username}'
+
+
+class TimelineEntry(models.Model):
+    """Рецепт в ленте подписчика.
+
+    Заполняется при публикации рецепта для всех подписчиков автора,
+    если его рецепты раскладываются по лентам (User.timeline_fan_out).
+    Автор и дата публикации продублированы, чтобы страница ленты
+    читалась диапазоном индекса, а отписка удаляла записи без соединения
+    с рецептами."""
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='timeline',
+        verbose_name='Подписчик'
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='timeline_entries',
+        verbose_name='Рецепт'
+    )
+    author = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Автор'
+    )
+    pub_date = models.DateTimeField(
+        verbose_name='Дата публикации'
+    )
+
+    class Meta:
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Записи ленты'
+        constraints = [
+            models.UniqueConstraint(
+                fields=('user', 'recipe'),
+                name='unique_recipe_in_timeline'
+            )
+        ]
+        indexes = (
+            models.Index(
+                fields=('user', '-pub_date', '-recipe'),
+                name='timeline_user_pub_date_idx'
+            ),
+            models.Index(
+                fields=('user', 'author'),
+                name='timeline_user_author_idx'
+            ),
+        )
+
+    def __str__(self):
+        return f'{self.recipe} в ленте @{self.user.username}'
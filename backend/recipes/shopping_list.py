@@ -0,0 +1,120 @@
+"""Поддержка сводного списка покупок в актуальном состоянии.
+
+Список хранится в ShoppingListItem: по строке на ингредиент с суммарным
+количеством. При добавлении и удалении рецепта из корзины количества
+меняются на разницу, при изменении состава рецепта списки его
+покупателей пересчитываются целиком."""
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Sum, When
+
+from recipes.models import (
+    IngredientRecipe, ShoppingCart, ShoppingList, ShoppingListItem
+)
+
+
+def _recipe_amounts(recipe_ids):
+    return dict(IngredientRecipe.objects.filter(
+        recipe_id__in=recipe_ids,
+        ingredient__isnull=False,
+    ).values_list('ingredient_id').annotate(
+        total_amount=Sum('amount')
+    ).order_by())
+
+
+def _lock(user_id, create=True):
+    if create:
+        ShoppingList.objects.get_or_create(user_id=user_id)
+    return ShoppingList.objects.select_for_update().filter(
+        user_id=user_id
+    ).exists()
+
+
+def _touch(user_ids):
+    ShoppingList.objects.filter(user_id__in=user_ids).update(
+        version=F('version') + 1
+    )
+
+
+def _change_amounts(user_id, amounts):
+    items = ShoppingListItem.objects.filter(
+        user_id=user_id,
+        ingredient_id__in=amounts,
+    )
+    existing = set(items.values_list('ingredient_id', flat=True))
+    if existing:
+        items.update(amount=F('amount') + Case(
+            *(When(ingredient_id=ingredient_id, then=amount)
+              for ingredient_id, amount in amounts.items()
+              if ingredient_id in existing),
+            default=0,
+            output_field=IntegerField(),
+        ))
+        items.filter(amount__lte=0).delete()
+    ShoppingListItem.objects.bulk_create(
+        ShoppingListItem(
+            user_id=user_id,
+            ingredient_id=ingredient_id,
+            amount=amount,
+        )
+        for ingredient_id, amount in amounts.items()
+        if ingredient_id not in existing and amount > 0
+    )
+
+
+def add_recipes(user_id, recipe_ids):
+    with transaction.atomic():
+        _lock(user_id)
+        _change_amounts(user_id, _recipe_amounts(recipe_ids))
+        _touch((user_id,))
+
+
+def remove_recipes(user_id, recipe_ids):
+    with transaction.atomic():
+        if not _lock(user_id, create=False):
+            return
+        _change_amounts(user_id, {
+            ingredient_id: -amount
+            for ingredient_id, amount in _recipe_amounts(recipe_ids).items()
+        })
+        _touch((user_id,))
+
+
+def rebuild(user_ids):
+    """Пересчитывает списки покупок пользователей по их корзинам."""
+    user_ids = set(user_ids)
+    if not user_ids:
+        return
+    with transaction.atomic():
+        ShoppingList.objects.bulk_create(
+            ShoppingList(user_id=user_id)
+            for user_id in user_ids - set(ShoppingList.objects.filter(
+                user_id__in=user_ids
+            ).values_list('user_id', flat=True))
+        )
+        list(ShoppingList.objects.select_for_update().filter(
+            user_id__in=user_ids
+        ).values_list('user_id', flat=True))
+        ShoppingListItem.objects.filter(user_id__in=user_ids).delete()
+        ShoppingListItem.objects.bulk_create(
+            ShoppingListItem(
+                user_id=item['recipe__shopping_cart__user'],
+                ingredient_id=item['ingredient'],
+                amount=item['total_amount'],
+            )
+            for item in IngredientRecipe.objects.filter(
+                recipe__shopping_cart__user__in=user_ids,
+                ingredient__isnull=False,
+            ).values(
+                'recipe__shopping_cart__user', 'ingredient'
+            ).annotate(
+                total_amount=Sum('amount')
+            ).order_by()
+        )
+        _touch(user_ids)
+
+
+def rebuild_for_recipe(recipe_id):
+    """Пересчитывает списки покупок всех, у кого рецепт в корзине."""
+    rebuild(ShoppingCart.objects.filter(
+        recipe_id=recipe_id
+    ).values_list('user_id', flat=True))
@@ -0,0 +1,137 @@
+from contextlib import contextmanager
+from threading import local
+
+from django.contrib.auth import get_user_model
+from django.db.models.signals import (
+    m2m_changed, post_delete, post_save, pre_delete
+)
+from django.dispatch import receiver
+from django_cleanup.signals import cleanup_pre_delete
+
+from recipes import counters, fragments, images, shopping_list, timeline
+from recipes.catalog import reference_catalog
+from recipes.models import Favorite, Ingredient, Recipe, ShoppingCart, Tag
+from users.models import Follow
+
+User = get_user_model()
+
+RECIPE_COUNTERS = {
+    Favorite: 'favorites_count',
+    ShoppingCart: 'in_shopping_cart_count',
+}
+
+_state = local()
+
+
+@contextmanager
+def muted():
+    """Отключает обработчики избранного и корзины в текущем потоке.
+
+    Для массовых операций: вызывающий код сам сообщает об изменениях
+    через recipes_added и recipes_removed."""
+    previous, _state.muted = is_muted(), True
+    try:
+        yield
+    finally:
+        _state.muted = previous
+
+
+def is_muted():
+    return getattr(_state, 'muted', False)
+
+
+def recipes_added(model, user_id, recipe_ids):
+    """Обновляет производные данные после добавления рецептов
+    в избранное или корзину пользователя."""
+    counters.change(Recipe, recipe_ids, **{RECIPE_COUNTERS[model]: 1})
+    if model is ShoppingCart:
+        shopping_list.add_recipes(user_id, recipe_ids)
+
+
+def recipes_removed(model, user_id, recipe_ids):
+    counters.change(Recipe, recipe_ids, **{RECIPE_COUNTERS[model]: -1})
+    if model is ShoppingCart:
+        shopping_list.remove_recipes(user_id, recipe_ids)
+
+
+@receiver((post_save, post_delete), sender=Tag)
+@receiver((post_save, post_delete), sender=Ingredient)
+def invalidate_reference_catalog(**kwargs):
+    reference_catalog.invalidate()
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def touch_recipe_tags(instance, action, reverse, pk_set, **kwargs):
+    if not reverse and action.startswith('post_'):
+        fragments.touch(Recipe.objects.filter(id=instance.id))
+    elif reverse and action == 'pre_clear':
+        fragments.touch(Recipe.objects.filter(tags=instance))
+    elif reverse and action.startswith('post_') and pk_set:
+        fragments.touch(Recipe.objects.filter(id__in=pk_set))
+
+
+@receiver(post_save, sender=Favorite)
+@receiver(post_save, sender=ShoppingCart)
+def add_user_recipe(sender, instance, created, **kwargs):
+    if created and not is_muted():
+        recipes_added(sender, instance.user_id, (instance.recipe_id,))
+
+
+@receiver(pre_delete, sender=Favorite)
+@receiver(pre_delete, sender=ShoppingCart)
+def remove_user_recipe(sender, instance, **kwargs):
+    if not is_muted():
+        recipes_removed(sender, instance.user_id, (instance.recipe_id,))
+
+
+@receiver(post_save, sender=Recipe)
+def build_recipe_image_variants(instance, **kwargs):
+    if instance.image and instance.image.name != instance.image_variants_for:
+        images.schedule_variants(instance.id)
+
+
+@receiver(post_delete, sender=Recipe)
+def delete_recipe_image_variants(instance, **kwargs):
+    if instance.image_variants_for:
+        images.schedule_delete_variants(instance.image_variants_for)
+
+
+@receiver(cleanup_pre_delete, sender=Recipe)
+def keep_shared_recipe_image(file, **kwargs):
+    """django-cleanup не удаляет файл, который есть у других рецептов."""
+    if images.is_shared(file.name):
+        file.name = None
+
+
+@receiver((post_save, post_delete), sender=Recipe)
+def count_recipes(instance, created=False, signal=None, **kwargs):
+    delta = 1 if created else -1 if signal is post_delete else 0
+    if delta:
+        counters.change(User, (instance.author_id,), recipes_count=delta)
+
+
+@receiver(post_save, sender=Recipe)
+def publish_to_timelines(instance, created, **kwargs):
+    if created:
+        timeline.publish(instance.id)
+
+
+@receiver((post_save, post_delete), sender=Follow)
+def count_follows(instance, created=False, signal=None, **kwargs):
+    delta = 1 if created else -1 if signal is post_delete else 0
+    if delta:
+        counters.change(User, (instance.author_id,), followers_count=delta)
+        counters.change(User, (instance.user_id,), following_count=delta)
+    if created:
+        timeline.stop_fan_out(instance.author_id)
+
+
+@receiver(post_save, sender=Follow)
+def backfill_timeline(instance, created, **kwargs):
+    if created:
+        timeline.follow(instance.user_id, instance.author_id)
+
+
+@receiver(post_delete, sender=Follow)
+def trim_timeline(instance, **kwargs):
+    timeline.unfollow(instance.user_id, instance.author_id)
@@ -0,0 +1,203 @@
+import csv
+import io
+import json
+import os
+import tempfile
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import CommandError, call_command
+from django.test import TestCase, TransactionTestCase
+
+from recipes import images, timeline
+from recipes.management.commands.imprint_initial_data import CSVStream
+from recipes.models import Ingredient, Recipe, Tag, TimelineEntry
+from users.models import Follow
+
+User = get_user_model()
+
+
+class SharedImageTests(TransactionTestCase):
+    """Общий файл изображения удаляется вместе с последним рецептом."""
+
+    def setUp(self):
+        self.author = User.objects.create_user(
+            email='author@example.com', username='author',
+            first_name='Имя', last_name='Фамилия', password='test-password'
+        )
+        self.image = default_storage.save(
+            'recipe/shared.jpg', ContentFile(b'image')
+        )
+        self.variant = images.variant_path(self.image, 'card', 'jpg')
+        default_storage.save(self.variant, ContentFile(b'variant'))
+        Recipe.objects.bulk_create(
+            Recipe(
+                author=self.author, name=f'Рецепт {number}', text='Текст',
+                cooking_time=5, image=self.image,
+                image_variants_for=self.image,
+            )
+            for number in range(2)
+        )
+
+    def test_shared_image_outlives_recipe(self):
+        first, second = Recipe.objects.all()
+        first.delete()
+        images.delete_variants(self.image)
+        self.assertTrue(default_storage.exists(self.image))
+        self.assertTrue(default_storage.exists(self.variant))
+        second.delete()
+        images.delete_variants(self.image)
+        self.assertFalse(default_storage.exists(self.image))
+        self.assertFalse(default_storage.exists(self.variant))
+
+
+@mock.patch('recipes.timeline.FEED_BACKFILL_RECIPES', 3)
+@mock.patch('recipes.timeline.FEED_FANOUT_MAX_FOLLOWERS', 1)
+class TimelineTests(TestCase):
+
+    def setUp(self):
+        self.author, self.first, self.second = (
+            User.objects.create_user(
+                email=f'{name}@example.com', username=name,
+                first_name='Имя', last_name='Фамилия',
+                password='test-password'
+            )
+            for name in ('author', 'first', 'second')
+        )
+        self.recipes = [
+            Recipe.objects.create(
+                author=self.author, name=f'P{number}', text='Текст',
+                cooking_time=5, image='recipe/test.jpg',
+            )
+            for number in range(5)
+        ]
+
+    def feed(self, user):
+        return [
+            Recipe.objects.get(id=row['id']).name
+            for row in timeline.page(user, limit=10)
+        ]
+
+    def follow(self, user):
+        Follow.objects.create(user=user, author=self.author)
+
+    def test_follow_copies_only_latest_recipes(self):
+        self.follow(self.first)
+        self.assertEqual(
+            TimelineEntry.objects.filter(user=self.first).count(), 3
+        )
+        self.assertEqual(self.feed(self.first), ['P4', 'P3', 'P2'])
+        Recipe.objects.create(
+            author=self.author, name='P5', text='Текст',
+            cooking_time=5, image='recipe/test.jpg',
+        )
+        self.assertEqual(self.feed(self.first), ['P5', 'P4', 'P3', 'P2'])
+
+    def test_recipes_stay_in_feed_below_threshold_again(self):
+        self.follow(self.first)
+        self.follow(self.second)
+        self.author.refresh_from_db()
+        self.assertFalse(self.author.timeline_fan_out)
+        expected = ['P4', 'P3', 'P2', 'P1', 'P0']
+        self.assertEqual(self.feed(self.first), expected)
+        self.assertEqual(self.feed(self.second), expected)
+        Follow.objects.filter(user=self.second).delete()
+        self.assertEqual(self.feed(self.first), expected)
+        self.assertEqual(self.feed(self.second), [])
+        self.follow(self.second)
+        self.assertEqual(self.feed(self.second), expected)
+
+    def test_reset_fan_out_and_rebuild(self):
+        self.follow(self.first)
+        self.follow(self.second)
+        Follow.objects.filter(user=self.second).delete()
+        timeline.reset_fan_out()
+        timeline.rebuild([self.first.id, self.second.id])
+        self.author.refresh_from_db()
+        self.assertTrue(self.author.timeline_fan_out)
+        self.assertEqual(
+            TimelineEntry.objects.filter(user=self.first).count(), 3
+        )
+        self.assertEqual(self.feed(self.first), ['P4', 'P3', 'P2'])
+        self.assertEqual(self.feed(self.second), [])
+
+
+class ImprintInitialDataTests(TestCase):
+    """Загрузка ингредиентов из JSON и CSV."""
+
+    rows = [
+        ('Сахар', 'г'), ('Соль', 'г'), ('Сахар', 'г'), ('Мука', 'кг'),
+        ('', 'г'), ('Вода', ''), ('Ы' * 201, 'г'), ('Молоко', 'мл'),
+    ]
+
+    @classmethod
+    def setUpTestData(cls):
+        Ingredient.objects.create(name='Соль', measurement_unit='г')
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def write(self, file_name, content):
+        path = os.path.join(self.directory, file_name)
+        with open(path, 'w', encoding='utf-8', newline='') as f:
+            f.write(content)
+        return path
+
+    def imprint(self, path, **options):
+        output = io.StringIO()
+        call_command('imprint_initial_data', path=path, stdout=output,
+                     **options)
+        return output.getvalue()
+
+    def assert_imported(self, output):
+        self.assertIn('inserted: 3, skipped: 5', output)
+        self.assertEqual(
+            set(Ingredient.objects.values_list('name', 'measurement_unit')),
+            {('Сахар', 'г'), ('Соль', 'г'), ('Мука', 'кг'), ('Молоко', 'мл')}
+        )
+        self.assertEqual(Tag.objects.count(), 5)
+
+    @mock.patch(
+        'recipes.management.commands.imprint_initial_data.JSON_CHUNK_SIZE', 7
+    )
+    def test_json(self):
+        self.write('ingredients.json', json.dumps([
+            {'name': name, 'measurement_unit': unit}
+            for name, unit in self.rows
+        ], ensure_ascii=False, indent=1))
+        self.assert_imported(self.imprint(self.directory))
+        self.assertIn('inserted: 0', self.imprint(self.directory))
+        self.assertEqual(Tag.objects.count(), 5)
+
+    def test_csv_in_batches(self):
+        content = io.StringIO()
+        csv.writer(content).writerows(
+            [('name', 'measurement_unit'), *self.rows]
+        )
+        path = self.write('ingredients.csv', content.getvalue())
+        self.assert_imported(self.imprint(path, batch_size=2))
+
+    def test_broken_json(self):
+        path = self.write('ingredients.json', '[{"name": "Сахар", ')
+        with self.assertRaisesMessage(CommandError, 'JSON-файл оборван.'):
+            self.imprint(path)
+
+    def test_copy_stream_matches_csv(self):
+        content = io.StringIO()
+        csv.writer(content).writerows(self.rows)
+        for size in (1, 5, 64, -1):
+            with self.subTest(size=size):
+                stream = CSVStream(self.rows)
+                chunks = []
+                while True:
+                    chunk = stream.read(size)
+                    if not chunk:
+                        break
+                    if size > 0:
+                        self.assertLessEqual(len(chunk), size)
+                    chunks.append(chunk)
+                self.assertEqual(''.join(chunks), content.getvalue())
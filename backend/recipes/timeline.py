@@ -0,0 +1,186 @@
+"""Лента рецептов авторов, на которых подписан пользователь.
+
+Рецепты обычных авторов раскладываются по TimelineEntry подписчиков
+при публикации (fan-out on write), подписка добавляет в ленту
+последние FEED_BACKFILL_RECIPES рецептов автора, отписка убирает их.
+Как только подписчиков у автора становится больше
+FEED_FANOUT_MAX_FOLLOWERS, с него снимается признак timeline_fan_out:
+его рецепты больше не копируются в ленты, а при чтении выбираются
+из рецептов и сливаются со строками ленты по дате. Признак
+не возвращается, когда подписчиков снова становится меньше, иначе
+пришлось бы разом заполнить ленты всех подписчиков; его пересчитывает
+reset_fan_out() перед rebuild(). Записи таких авторов, оставшиеся
+в ленте, при чтении пропускаются."""
+import heapq
+from itertools import islice
+
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+from django.db.models import Exists, OuterRef, Q
+
+from foodgram.settings import FEED_BACKFILL_RECIPES, FEED_FANOUT_MAX_FOLLOWERS
+from recipes.models import Favorite, Recipe, ShoppingCart, TimelineEntry
+from users.models import Follow
+
+User = get_user_model()
+
+FAN_OUT_SQL = (
+    '{insert} {timeline} (user_id, recipe_id, author_id, pub_date) '
+    'SELECT follow.user_id, recipe.id, recipe.author_id, recipe.pub_date '
+    'FROM {follow} follow '
+    'JOIN {recipes} recipe ON recipe.author_id = follow.author_id '
+    'JOIN {user} author ON author.id = follow.author_id '
+    'WHERE author.timeline_fan_out AND {condition} {suffix}'
+)
+
+RECENT_RECIPES_SQL = (
+    '(SELECT id, author_id, pub_date, ROW_NUMBER() OVER ('
+    'PARTITION BY author_id ORDER BY pub_date DESC, id DESC'
+    ') AS position FROM {recipe} WHERE {authors})'
+)
+
+FEED_FIELDS = (
+    'id', 'author_id', 'pub_date', 'updated_at', 'author_updated_at',
+    'is_favorited', 'is_in_shopping_cart'
+)
+
+
+def _fan_out(condition, params, authors=None, author_params=()):
+    """Копирует в ленты рецепты авторов с timeline_fan_out по условию
+    на follow и recipe; уже существующие записи пропускаются. С условием
+    authors на столбец author_id копируются только последние
+    FEED_BACKFILL_RECIPES рецептов каждого из этих авторов."""
+    recipe_table = Recipe._meta.db_table
+    if authors is None:
+        recipes = recipe_table
+    else:
+        recipes = RECENT_RECIPES_SQL.format(
+            recipe=recipe_table, authors=authors
+        )
+        condition = f'{condition} AND recipe.position <= %s'
+        params = [*params, FEED_BACKFILL_RECIPES]
+    sql = FAN_OUT_SQL.format(
+        insert=connection.ops.insert_statement(ignore_conflicts=True),
+        timeline=TimelineEntry._meta.db_table,
+        follow=Follow._meta.db_table,
+        recipes=recipes,
+        user=User._meta.db_table,
+        condition=condition,
+        suffix=connection.ops.ignore_conflicts_suffix_sql(
+            ignore_conflicts=True
+        ),
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [*author_params, *params])
+
+
+def publish(recipe_id):
+    """Добавляет новый рецепт в ленты подписчиков автора."""
+    _fan_out('recipe.id = %s', [recipe_id])
+
+
+def follow(user_id, author_id):
+    """Добавляет в ленту последние рецепты автора, на которого
+    подписались."""
+    _fan_out(
+        'follow.user_id = %s AND follow.author_id = %s',
+        [user_id, author_id],
+        authors='author_id = %s',
+        author_params=[author_id],
+    )
+
+
+def unfollow(user_id, author_id):
+    TimelineEntry.objects.filter(user_id=user_id, author_id=author_id).delete()
+
+
+def stop_fan_out(author_id):
+    """Снимает timeline_fan_out с автора, у которого стало слишком много
+    подписчиков."""
+    User.objects.filter(
+        id=author_id,
+        timeline_fan_out=True,
+        followers_count__gt=FEED_FANOUT_MAX_FOLLOWERS,
+    ).update(timeline_fan_out=False)
+
+
+def reset_fan_out():
+    """Пересчитывает timeline_fan_out всех авторов по числу подписчиков.
+    Ленты их подписчиков после этого нужно пересобрать."""
+    with transaction.atomic():
+        User.objects.filter(
+            followers_count__gt=FEED_FANOUT_MAX_FOLLOWERS
+        ).update(timeline_fan_out=False)
+        User.objects.filter(
+            followers_count__lte=FEED_FANOUT_MAX_FOLLOWERS
+        ).update(timeline_fan_out=True)
+
+
+def rebuild(user_ids):
+    """Пересобирает ленты пользователей по их подпискам."""
+    user_ids = list(user_ids)
+    if not user_ids:
+        return
+    users = ', '.join(['%s'] * len(user_ids))
+    with transaction.atomic():
+        TimelineEntry.objects.filter(user_id__in=user_ids).delete()
+        _fan_out(
+            f'follow.user_id IN ({users})', user_ids,
+            authors=(
+                f'author_id IN (SELECT author_id FROM '
+                f'{Follow._meta.db_table} WHERE user_id IN ({users}))'
+            ),
+            author_params=user_ids,
+        )
+
+
+def _after(cursor, id_field):
+    pub_date, recipe_id = cursor
+    return Q(pub_date__lt=pub_date) | Q(**{
+        'pub_date': pub_date,
+        f'{id_field}__lt': recipe_id,
+    })
+
+
+def _rows(queryset, user, id_field, cursor, limit):
+    recipe = 'recipe__' if id_field == 'recipe_id' else ''
+    if cursor is not None:
+        queryset = queryset.filter(_after(cursor, id_field))
+    return [
+        dict(zip(FEED_FIELDS, row))
+        for row in queryset.annotate(
+            is_favorited=Exists(Favorite.objects.filter(
+                user=user, recipe=OuterRef(id_field)
+            )),
+            is_in_shopping_cart=Exists(ShoppingCart.objects.filter(
+                user=user, recipe=OuterRef(id_field)
+            )),
+        ).order_by('-pub_date', f'-{id_field}').values_list(
+            id_field, 'author_id', 'pub_date', f'{recipe}updated_at',
+            'author__updated_at', 'is_favorited', 'is_in_shopping_cart'
+        )[:limit]
+    ]
+
+
+def page(user, cursor=None, limit=6):
+    """Строки ленты после курсора (pub_date, id рецепта) от новых
+    к старым: id, author_id, pub_date, версии рецепта и автора
+    и признаки избранного и корзины зрителя."""
+    popular = list(Follow.objects.filter(
+        user=user, author__timeline_fan_out=False
+    ).values_list('author_id', flat=True))
+    entries = TimelineEntry.objects.filter(user=user)
+    if popular:
+        entries = entries.exclude(author_id__in=popular)
+    rows = _rows(entries, user, 'recipe_id', cursor, limit)
+    if not popular:
+        return rows
+    return list(islice(heapq.merge(
+        rows,
+        _rows(
+            Recipe.objects.filter(author_id__in=popular),
+            user, 'id', cursor, limit
+        ),
+        key=lambda row: (row['pub_date'], row['id']),
+        reverse=True
+    ), limit))
@@ -8,7 +8,10 @@ User = get_user_model()
 
 @admin.register(User)
 class UserAdmin(admin.ModelAdmin):
-    list_display = ('email', 'username', 'first_name', 'last_name')
+    list_display = (
+        'email', 'username', 'first_name', 'last_name',
+        'recipes_count', 'followers_count'
+    )
     search_fields = ('username', 'email')
     ordering = ('email',)
 
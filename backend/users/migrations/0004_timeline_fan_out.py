@@ -0,0 +1,27 @@
+# Generated by Django 2.2.19 on 2026-10-18 18:50
+
+from django.db import migrations, models
+
+from foodgram.settings import FEED_FANOUT_MAX_FOLLOWERS
+
+
+def stop_popular_fan_out(apps, schema_editor):
+    apps.get_model('users', 'User').objects.filter(
+        followers_count__gt=FEED_FANOUT_MAX_FOLLOWERS
+    ).update(timeline_fan_out=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0003_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='timeline_fan_out',
+            field=models.BooleanField(default=True, editable=False, verbose_name='Рецепты раскладываются по лентам подписчиков'),
+        ),
+        migrations.RunPython(stop_popular_fan_out, migrations.RunPython.noop),
+    ]
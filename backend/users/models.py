@@ -4,7 +4,32 @@ from django.db import models
 from users.validators import validate_username
 
 
-class User(AbstractUser):
+class CounterFieldsMixin:
+    """Не дает полному save() затереть счетчики.
+
+    Счетчики и связанные с ними признаки меняются запросами UPDATE
+    в обход экземпляров, поэтому значения в загруженном объекте могут
+    устареть. save() без update_fields обновляет все поля, кроме
+    counter_fields."""
+
+    counter_fields = ()
+
+    def save(self, *args, **kwargs):
+        if (
+            not self._state.adding
+            and not kwargs.get('force_insert')
+            and kwargs.get('update_fields') is None
+        ):
+            skipped = {*self.counter_fields, *self.get_deferred_fields()}
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in skipped
+                and field.attname not in skipped
+            ]
+        super().save(*args, **kwargs)
+
+
+class User(CounterFieldsMixin, AbstractUser):
     """Модель пользователя."""
 
     email = models.EmailField(
@@ -33,6 +58,34 @@ class User(AbstractUser):
     password = models.CharField(
         max_length=150,
     )
+    recipes_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Рецептов'
+    )
+    followers_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Подписчиков'
+    )
+    following_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Подписок'
+    )
+    timeline_fan_out = models.BooleanField(
+        default=True,
+        editable=False,
+        verbose_name='Рецепты раскладываются по лентам подписчиков'
+    )
+    updated_at = models.DateTimeField(
+        auto_now=True,
+        verbose_name='Дата изменения'
+    )
+    counter_fields = (
+        'recipes_count', 'followers_count', 'following_count',
+        'timeline_fan_out'
+    )
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['username', 'first_name', 'last_name']
 